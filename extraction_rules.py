@@ -0,0 +1,247 @@
+"""
+Declarative extraction rules
+
+A rule finds a value relative to an anchor line, e.g. "the line below
+'Recipient'" or "the name after the last slash on the 'To Account No.'
+line". Rules are plain dicts, so they can live in bank_config.json, and
+are compiled once into closures; running a rule does no spec lookups.
+
+Rule keys (all optional):
+    name          label used in results and traces
+    anchor        substring or list of substrings; omit to try every line
+    anchor_regex  regex searched in the line instead of anchor
+    exclude       skip anchor lines containing any of these substrings
+    offset        where the value is relative to the anchor line: an int
+                  (0 = same line, 1 = next line), "right", "below", or a
+                  list of these tried in order (default 1)
+    window        try each of the next `window` lines instead of offset
+    target        value lines must contain one of these substrings
+    pattern       regex searched in the value line; group 1 is the value
+                  when the pattern has a group
+    reject        discard values containing any of these substrings
+    min_length    minimum value length
+    validate      name of a validator supplied by the caller, called as
+                  validator(value) -> (clean_value, None) or (None, reason)
+    values        list of value specs (offset ... validate) tried in order
+                  for each anchor line, each inheriting the rule's keys
+    match_case    make anchor, exclude, target and reject tests
+                  case-sensitive (they ignore case by default)
+
+Patterns are always case-sensitive unless they use (?i).
+"""
+import re
+from collections import namedtuple
+
+# A rule compiled to closures:
+#   match_at(document, i, line_hits=None, observe=None) -> RuleMatch or None
+#   run(document, line_hits=None, observe=None) -> RuleMatch or None
+# observe, when given, is called for every value line tried as
+#   observe(rule_name, anchor_line, value_line, how, candidate, reject_reason)
+Rule = namedtuple('Rule', 'name anchors match_at run')
+
+RuleMatch = namedtuple('RuleMatch', 'value line anchor how rule')
+
+_VALUE_KEYS = ('offset', 'window', 'target', 'pattern', 'reject', 'min_length', 'validate', 'match_case')
+
+
+def _needles(value, match_case=False):
+    """Substrings from a string or list, lowercased unless match_case"""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = [value]
+    return tuple(v if match_case else v.lower() for v in value if v)
+
+
+def _document_view(document):
+    """(lines, lower_lines, spatial_index) for an OCRDocument or a plain list of lines"""
+    lines = getattr(document, 'lines', document)
+    lower_lines = getattr(document, 'lower_lines', None)
+    if lower_lines is None:
+        lower_lines = [line.lower() for line in lines]
+    return lines, lower_lines, getattr(document, 'spatial_index', None)
+
+
+def _compile_anchor(spec):
+    """Return (anchor_keywords, test(i, lines, lower_lines, line_hits))"""
+    if spec.get('anchor_regex'):
+        regex = re.compile(spec['anchor_regex'], re.IGNORECASE)
+        return (), lambda i, lines, lower_lines, line_hits: regex.search(lines[i]) is not None
+
+    match_case = spec.get('match_case', False)
+    keywords = _needles(spec.get('anchor'), match_case)
+    if not keywords:
+        return (), None
+
+    if match_case:
+        return keywords, lambda i, lines, lower_lines, line_hits: any(keyword in lines[i] for keyword in keywords)
+
+    keyword_set = frozenset(keywords)
+
+    def test(i, lines, lower_lines, line_hits):
+        # line_hits holds the keywords a shared matcher found on each line
+        if line_hits is not None:
+            return not keyword_set.isdisjoint(line_hits[i])
+        lower_line = lower_lines[i]
+        return any(keyword in lower_line for keyword in keywords)
+
+    return keywords, test
+
+
+def _compile_selector(spec):
+    """Return select(i, n, spatial_index) -> [(how, j)] for the value lines of an anchor line"""
+    if spec.get('window'):
+        offsets = list(range(1, int(spec['window']) + 1))
+    else:
+        offsets = spec.get('offset', 1)
+        if not isinstance(offsets, list):
+            offsets = [offsets]
+
+    def label(offset):
+        return {0: 'same', 1: 'next'}.get(offset, f"+{offset}")
+
+    if all(isinstance(offset, int) for offset in offsets):
+        deltas = tuple((label(offset), offset) for offset in offsets)
+
+        def select(i, n, spatial_index):
+            return [(how, i + delta) for how, delta in deltas if 0 <= i + delta < n
+                    and (spatial_index is None or spatial_index.same_page(i, i + delta))]
+
+        return select
+
+    def select(i, n, spatial_index):
+        selected = []
+        for offset in offsets:
+            if offset == 'right':
+                how, j = offset, spatial_index.right_of(i) if spatial_index is not None else None
+            elif offset == 'below':
+                how, j = offset, spatial_index.below(i) if spatial_index is not None else None
+            else:
+                how, j = label(offset), i + offset
+                if spatial_index is not None and 0 <= j < n and not spatial_index.same_page(i, j):
+                    j = None
+
+            if j is not None and 0 <= j < n and (offset == 0 or j != i) and all(j != s for _, s in selected):
+                selected.append((how, j))
+        return selected
+
+    return select
+
+
+def _compile_extractor(spec, validators):
+    """
+    Return extract(text) -> (value, candidate, reason)
+
+    candidate is the value handed to the validator (None when the line was
+    rejected before validation); value is the validated result or None.
+    """
+    match_case = spec.get('match_case', False)
+    targets = _needles(spec.get('target'), match_case)
+    pattern = re.compile(spec['pattern']) if spec.get('pattern') else None
+    use_group = pattern is not None and pattern.groups > 0
+    rejects = _needles(spec.get('reject'), match_case)
+    min_length = spec.get('min_length', 0)
+
+    validator = None
+    if spec.get('validate'):
+        if spec['validate'] not in validators:
+            raise ValueError(f"Unknown validator '{spec['validate']}' in rule {spec.get('name', '')!r}")
+        validator = validators[spec['validate']]
+
+    def extract(text):
+        text = text.strip()
+        if targets:
+            haystack = text if match_case else text.lower()
+            if not any(target in haystack for target in targets):
+                return None, None, 'no target'
+
+        if pattern is not None:
+            match = pattern.search(text)
+            if not match:
+                return None, None, 'pattern mismatch'
+            value = (match.group(1) if use_group else match.group(0)).strip()
+        else:
+            value = text
+
+        if rejects:
+            haystack = value if match_case else value.lower()
+            if any(reject in haystack for reject in rejects):
+                return None, None, 'rejected word'
+        if len(value) < min_length:
+            return None, None, 'too short'
+        if validator is not None:
+            clean_value, reason = validator(value)
+            return clean_value, value, reason
+        return value, value, None
+
+    return extract
+
+
+def compile_rule(spec, validators=None):
+    """
+    Compile a rule spec into a Rule
+
+    Args:
+        spec: Rule dict (see module docstring)
+        validators: Mapping of validator name -> callable for the `validate` key
+    """
+    validators = validators or {}
+    name = spec.get('name', '')
+    anchors, anchor_test = _compile_anchor(spec)
+    match_case = spec.get('match_case', False)
+    excludes = _needles(spec.get('exclude'), match_case)
+
+    value_specs = spec.get('values') or [{}]
+    base = {key: spec[key] for key in _VALUE_KEYS if key in spec}
+    finders = []
+    for value_spec in value_specs:
+        merged = dict(base, name=name, **value_spec)
+        finders.append((_compile_selector(merged), _compile_extractor(merged, validators)))
+
+    def match_lines(i, lines, lower_lines, spatial_index, line_hits, observe):
+        if anchor_test is not None and not anchor_test(i, lines, lower_lines, line_hits):
+            return None
+        if excludes:
+            haystack = lines[i] if match_case else lower_lines[i]
+            if any(exclude in haystack for exclude in excludes):
+                return None
+
+        n = len(lines)
+        for select, extract in finders:
+            for how, j in select(i, n, spatial_index):
+                value, candidate, reason = extract(lines[j])
+                if observe is not None:
+                    observe(name, i, j, how, candidate, reason)
+                if value:
+                    return RuleMatch(value, j, i, how, name)
+        return None
+
+    def match_at(document, i, line_hits=None, observe=None):
+        """Try anchor line i only"""
+        lines, lower_lines, spatial_index = _document_view(document)
+        return match_lines(i, lines, lower_lines, spatial_index, line_hits, observe)
+
+    def run(document, line_hits=None, observe=None):
+        """Return the first match scanning anchor lines top to bottom"""
+        lines, lower_lines, spatial_index = _document_view(document)
+        for i in range(len(lines)):
+            match = match_lines(i, lines, lower_lines, spatial_index, line_hits, observe)
+            if match is not None:
+                return match
+        return None
+
+    return Rule(name, anchors, match_at, run)
+
+
+def compile_rules(specs, validators=None):
+    """Compile a list of rule specs in order"""
+    return [compile_rule(spec, validators) for spec in specs]
+
+
+def first_match(rules, document, line_hits=None, observe=None):
+    """Run rules in order and return the first RuleMatch, or None"""
+    for rule in rules:
+        match = rule.run(document, line_hits, observe)
+        if match is not None:
+            return match
+    return None
@@ -1,25 +1,1944 @@
+import argparse
+import asyncio
+import bisect
 import boto3
+import csv
+import ctypes
+import errno
+import fitz  # PyMuPDF
 import os
 import re
 from dotenv import load_dotenv
 from pathlib import Path
 import json
+import hashlib
+import io
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from itertools import chain
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import AsyncExitStack
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from PIL import Image, ImageOps
+from name_scorer import NameScorer
+from extraction_rules import compile_rule, compile_rules, first_match
+
+try:
+    # Optional: native asyncio Textract client for aprocess_folder
+    from aiobotocore.session import get_session as get_aio_session
+    from aiobotocore.config import AioConfig
+except ImportError:
+    get_aio_session = None
+
+
+class OCRDocument:
+    """
+    Compact, array-backed OCR result for one receipt
+    
+    Holds line text plus confidence and bounding box (Left, Top, Width,
+    Height, normalized to the page) in flat float arrays instead of one dict
+    per line, and the page of each line for multi-page documents (empty when
+    the OCR output has no pages). Derived views (full text, lowercase lines)
+    are computed on first use and cached.
+    """
+    
+    __slots__ = ('lines', 'confidences', 'boxes', 'pages', '_full_text', '_lower_lines',
+                 '_full_text_lower', '_spatial_index')
+    
+    def __init__(self, lines, confidences=None, boxes=None, pages=None):
+        self.lines = lines
+        self.confidences = confidences if confidences is not None else array('f')
+        self.boxes = boxes if boxes is not None else array('f')
+        self.pages = pages if pages is not None else array('H')
+        self._full_text = None
+        self._lower_lines = None
+        self._full_text_lower = None
+        self._spatial_index = None
+    
+    @classmethod
+    def from_blocks(cls, blocks):
+        """Build a document from compact LINE block dicts"""
+        lines = []
+        confidences = array('f')
+        boxes = array('f')
+        pages = array('H')
+        has_geometry = True
+        
+        for block in blocks:
+            lines.append(block['Text'])
+            confidences.append(block.get('Confidence') or 0.0)
+            pages.append(block.get('Page') or 1)
+            box = block.get('BoundingBox')
+            if box and has_geometry:
+                boxes.extend((box['Left'], box['Top'], box['Width'], box['Height']))
+            else:
+                has_geometry = False
+        
+        # Single-page output needs no page numbers
+        if all(page == 1 for page in pages):
+            pages = array('H')
+        return cls(lines, confidences, boxes if has_geometry else array('f'), pages)
+    
+    @classmethod
+    def from_text(cls, text):
+        """Build a document from plain text, one line per row"""
+        return cls(text.split('\n') if text else [])
+    
+    def __len__(self):
+        return len(self.lines)
+    
+    @property
+    def has_geometry(self):
+        return len(self.boxes) == 4 * len(self.lines) and len(self.lines) > 0
+    
+    def bbox(self, i):
+        """Bounding box of line i as (left, top, width, height), or None"""
+        if not self.has_geometry:
+            return None
+        return tuple(self.boxes[4 * i:4 * i + 4])
+    
+    def page(self, i):
+        """Page number of line i (1 for single-page documents)"""
+        return self.pages[i] if self.pages else 1
+    
+    @property
+    def full_text(self):
+        if self._full_text is None:
+            self._full_text = '\n'.join(self.lines)
+        return self._full_text
+    
+    @property
+    def lower_lines(self):
+        if self._lower_lines is None:
+            self._lower_lines = [line.lower() for line in self.lines]
+        return self._lower_lines
+    
+    @property
+    def full_text_lower(self):
+        if self._full_text_lower is None:
+            self._full_text_lower = '\n'.join(self.lower_lines)
+        return self._full_text_lower
+    
+    @property
+    def spatial_index(self):
+        """LineSpatialIndex over the line boxes, or None without geometry"""
+        if self._spatial_index is None and self.has_geometry:
+            self._spatial_index = LineSpatialIndex(self)
+        return self._spatial_index
+
+
+class LineSpatialIndex:
+    """
+    Sorted interval index over a document's LINE bounding boxes
+    
+    Lines are kept sorted by vertical center and by top edge, so the
+    neighbour to the right of a line (same row) or below it (same column)
+    is found by bisection plus a short local scan instead of a pass over
+    every line. Boxes are normalized per page, so each page is shifted down
+    by its index and neighbours never come from another page.
+    """
+    
+    def __init__(self, document):
+        self.document = document
+        self._pages = [document.page(i) for i in range(len(document))]
+        boxes = []
+        for i in range(len(document)):
+            left, top, width, height = document.bbox(i)
+            boxes.append((left, top + self._pages[i] - 1, width, height))
+        self._boxes = boxes
+        
+        by_center = sorted(range(len(boxes)), key=lambda i: boxes[i][1] + boxes[i][3] / 2)
+        self._center_order = by_center
+        self._centers = [boxes[i][1] + boxes[i][3] / 2 for i in by_center]
+        
+        by_top = sorted(range(len(boxes)), key=lambda i: boxes[i][1])
+        self._top_order = by_top
+        self._tops = [boxes[i][1] for i in by_top]
+    
+    def same_page(self, i, j):
+        """Whether lines i and j are on the same page"""
+        return self._pages[i] == self._pages[j]
+    
+    def right_of(self, i):
+        """Nearest line on the same row to the right of line i, or None"""
+        left, top, width, height = self._boxes[i]
+        right = left + width
+        
+        start = bisect.bisect_left(self._centers, top)
+        end = bisect.bisect_right(self._centers, top + height)
+        
+        best, best_gap = None, None
+        for j in self._center_order[start:end]:
+            if j == i or self._pages[j] != self._pages[i]:
+                continue
+            gap = self._boxes[j][0] - right
+            if gap >= -0.01 * width and (best_gap is None or gap < best_gap):
+                best, best_gap = j, gap
+        return best
+    
+    def below(self, i, max_lines=3):
+        """Nearest line below line i that overlaps it horizontally, within max_lines line heights"""
+        left, top, width, height = self._boxes[i]
+        bottom = top + height
+        limit = bottom + max_lines * height
+        
+        start = bisect.bisect_left(self._tops, bottom - 0.25 * height)
+        for j in self._top_order[start:]:
+            other_left, other_top, other_width, _ = self._boxes[j]
+            if other_top > limit or self._pages[j] != self._pages[i]:
+                break
+            if j != i and other_left < left + width and other_left + other_width > left:
+                return j
+        return None
+
+
+class KeywordMatcher:
+    """
+    Finds every configured keyword in a text with a single regex scan
+    
+    The keywords are compiled into one trie-shaped pattern (a lookahead at
+    each position), so the work per position depends on keyword length,
+    not on how many keywords are configured. Keywords that are prefixes
+    of a longer match at the same position are added back afterwards, so
+    the result equals checking `keyword in text` for every keyword.
+    """
+    
+    _NO_HITS = frozenset()
+    
+    def __init__(self, keywords):
+        self.keywords = list(OrderedDict.fromkeys(k.lower() for k in keywords if k))
+        self._regex = None
+        self._implied = {}
+        
+        if not self.keywords:
+            return
+        
+        trie = {}
+        for keyword in self.keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = True
+        
+        self._regex = re.compile(f"(?=({self._trie_pattern(trie)}))")
+        self._implied = {
+            keyword: tuple(k for k in self.keywords if keyword.startswith(k))
+            for keyword in self.keywords
+        }
+    
+    @classmethod
+    def _trie_pattern(cls, node):
+        alternatives = [re.escape(char) + cls._trie_pattern(child)
+                        for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ''
+        body = alternatives[0] if len(alternatives) == 1 else f"(?:{'|'.join(alternatives)})"
+        # Greedy optional suffix: the longest keyword at a position wins
+        return f"(?:{body})?" if '' in node else body
+    
+    def find_all(self, text_lower):
+        """Return the set of keywords contained in an already-lowercased text"""
+        found = set()
+        if self._regex is None:
+            return found
+        for match in self._regex.finditer(text_lower):
+            found.update(self._implied[match.group(1)])
+        return found
+    
+    def find_outermost(self, text_lower):
+        """
+        Keywords with at least one occurrence not inside a longer keyword's match
+        
+        Takes the longest keyword at each position (without the implied
+        prefixes) and skips matches that end within an earlier match.
+        """
+        found = set()
+        if self._regex is None:
+            return found
+        reach = -1
+        for match in self._regex.finditer(text_lower):
+            keyword = match.group(1)
+            end = match.start() + len(keyword)
+            if end > reach:
+                found.add(keyword)
+                reach = end
+        return found
+    
+    def find_lines(self, lines_lower):
+        """
+        find_all for every line, in one scan of the joined text
+        
+        Keywords never contain a newline, so each match belongs to the line
+        its start offset falls in. Lines without keywords share one empty
+        frozenset.
+        """
+        hits = [self._NO_HITS] * len(lines_lower)
+        if self._regex is None or not lines_lower:
+            return hits
+        
+        line_ends = []
+        offset = 0
+        for line in lines_lower:
+            offset += len(line) + 1
+            line_ends.append(offset)
+        
+        # Matches come in text order, so the line index only moves forward
+        implied = self._implied
+        i = 0
+        for match in self._regex.finditer('\n'.join(lines_lower)):
+            start = match.start()
+            while start >= line_ends[i]:
+                i += 1
+            if hits[i] is self._NO_HITS:
+                hits[i] = set()
+            hits[i].update(implied[match.group(1)])
+        return hits
+
+
+class OCRCache:
+    """Persistent on-disk cache of OCR LINE blocks with a size budget and LRU eviction
+
+    Entries are keyed by the SHA-256 of the image bytes plus the OCR backend
+    name, so a file that was already read costs nothing on the next run even
+    if it has been renamed since. Each entry is one JSON file; its mtime is
+    the last access time, which keeps the LRU order across runs.
+    """
+    
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, oldest first
+        self._total_bytes = 0
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        
+        existing = []
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    existing.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+            self._total_bytes += size
+    
+    @staticmethod
+    def make_key(image_bytes, backend_name):
+        """Build the cache key for an image and OCR backend"""
+        return f"{backend_name}-{hashlib.sha256(image_bytes).hexdigest()}"
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def get(self, key):
+        """Return cached LINE blocks for a key, or None on a miss"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        
+        try:
+            path = self._path(key)
+            with open(path, 'r', encoding='utf-8') as f:
+                blocks = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            self.hits += 1
+        return blocks
+    
+    def put(self, key, blocks):
+        """Store LINE blocks for a key, evicting least recently used entries"""
+        data = json.dumps(blocks, ensure_ascii=False).encode('utf-8')
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        
+        evicted = []
+        with self._lock:
+            old_size = self._entries.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_key)
+        
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+    
+    def reset_stats(self):
+        """Reset hit and miss counters"""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+class OCRTextStore:
+    """Compact store of first-pass OCR text, kept in memory and spilled to disk past a budget"""
+    
+    def __init__(self, max_memory_bytes):
+        self.max_memory_bytes = max_memory_bytes
+        self._lock = threading.Lock()
+        self._memory = {}  # key -> zlib-compressed text
+        self._memory_bytes = 0
+        self._spilled = {}  # key -> path of spilled file
+        self._spill_dir = None
+    
+    def put(self, key, text_lines):
+        """Store the extracted lines for a file"""
+        data = zlib.compress('\n'.join(text_lines).encode('utf-8'))
+        
+        with self._lock:
+            self._discard(key)
+            if self._memory_bytes + len(data) <= self.max_memory_bytes:
+                self._memory[key] = data
+                self._memory_bytes += len(data)
+                return
+            
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix='receipt_ocr_text_')
+            path = os.path.join(self._spill_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+            self._spilled[key] = path
+        
+        with open(path, 'wb') as f:
+            f.write(data)
+    
+    def get(self, key):
+        """Return the stored lines for a file, or None if nothing was kept"""
+        with self._lock:
+            data = self._memory.get(key)
+            path = self._spilled.get(key)
+        
+        if data is None and path is not None:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                return None
+        
+        if data is None:
+            return None
+        
+        text = zlib.decompress(data).decode('utf-8')
+        return text.split('\n') if text else []
+    
+    def _discard(self, key):
+        data = self._memory.pop(key, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        path = self._spilled.pop(key, None)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def clear(self):
+        """Drop all stored text and remove the spill directory"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._spilled.clear()
+            spill_dir, self._spill_dir = self._spill_dir, None
+        
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+class CustomerIndex:
+    """Persistent dictionary of known customer names with a fuzzy lookup index
+
+    Names are normalized (upper case, letters only, OCR digit look-alikes
+    such as 1 -> I and 0 -> O folded) so "WONG CHUN T1M" and "Wong Chun Tim"
+    share one key. Approximate matches use a SymSpell-style deletion index:
+    every known key is stored under all of its variants with up to
+    max_distance characters deleted, so a lookup only generates the
+    deletions of the candidate and verifies the few names they point to.
+    
+    Approximate matching is reserved for candidates that look like OCR
+    noise, since two real customers can be an edit apart ("LEE MEI LING"
+    and "LEE MEI MING"), and only names from trusted extraction paths are
+    learned.
+    """
+    
+    LOOKALIKES = str.maketrans({'1': 'I', '|': 'I', '!': 'I', '0': 'O', '5': 'S', '8': 'B', '$': 'S'})
+    
+    # Extraction paths reliable enough to teach the index (besides manual renames)
+    LEARN_FROM = frozenset({'bank_extractor', 'method1'})
+    
+    def __init__(self, index_file, max_distance=2, min_length=6):
+        self.index_file = index_file
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self._lock = threading.Lock()
+        self._names = {}  # key -> display name
+        self._counts = {}  # key -> times seen
+        self._deletes = {}  # deletion variant -> set of keys
+        self._sources = {}  # seeded file path -> mtime
+        self._max_key_length = 0
+        self._dirty = False
+        
+        if os.path.exists(index_file):
+            try:
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                for name, count in data.get('customers', {}).items():
+                    self._add(name, count)
+                self._sources = data.get('sources', {})
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not read customer index {index_file}: {e}")
+    
+    def __len__(self):
+        return len(self._names)
+    
+    @classmethod
+    def normalize(cls, name):
+        """Fold a name to its lookup key"""
+        folded = name.upper().translate(cls.LOOKALIKES)
+        return ' '.join(re.sub(r'[^A-Z\s]', '', folded).split())
+    
+    @staticmethod
+    def _deletions(key, max_distance):
+        """All variants of key with up to max_distance characters deleted"""
+        variants = {key}
+        frontier = {key}
+        for _ in range(max_distance):
+            frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+            variants |= frontier
+        return variants
+    
+    @staticmethod
+    def _distance(a, b, limit):
+        """Levenshtein distance between a and b, or limit + 1 once it is exceeded"""
+        if abs(len(a) - len(b)) > limit:
+            return limit + 1
+        previous = list(range(len(b) + 1))
+        for i, char_a in enumerate(a, 1):
+            current = [i]
+            for j, char_b in enumerate(b, 1):
+                current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+            if min(current) > limit:
+                return limit + 1
+            previous = current
+        return previous[-1]
+    
+    def _add(self, name, count=1):
+        key = self.normalize(name)
+        if len(key) < self.min_length:
+            return
+        if key not in self._names:
+            self._names[key] = ' '.join(name.split())
+            self._max_key_length = max(self._max_key_length, len(key))
+            for variant in self._deletions(key, self.max_distance):
+                self._deletes.setdefault(variant, set()).add(key)
+        self._counts[key] = self._counts.get(key, 0) + count
+    
+    def add(self, name):
+        """Record a customer name confirmed by a rename"""
+        with self._lock:
+            self._add(name)
+            self._dirty = True
+    
+    @classmethod
+    def is_learnable(cls, result):
+        """Whether a result's name is trustworthy enough to add to the index"""
+        if result.get('status') == 'success_manual':
+            return True
+        return result.get('status') == 'success' and result.get('extraction_path') in cls.LEARN_FROM
+    
+    def lookup(self, candidate, fuzzy=False):
+        """
+        Return the known customer name matching candidate, or None
+        
+        An exact match after normalization always counts. Approximate
+        matches are only tried when fuzzy is set (the candidate failed
+        validation) or look-alike folding changed the candidate, and are
+        accepted only when a single known name is closest.
+        """
+        key = self.normalize(candidate)
+        if not self.min_length <= len(key) <= self._max_key_length + self.max_distance:
+            return None
+        
+        upper = candidate.upper()
+        fuzzy = fuzzy or upper.translate(self.LOOKALIKES) != upper
+        
+        with self._lock:
+            # Fast path: exact match after normalization
+            name = self._names.get(key)
+            if name is not None or not fuzzy:
+                return name
+            
+            # Shorter names tolerate fewer edits
+            limit = self.max_distance if len(key) >= 10 else 1
+            matches = set()
+            for variant in self._deletions(key, limit):
+                matches |= self._deletes.get(variant, set())
+            
+            best_distance, best = limit + 1, []
+            for match in matches:
+                distance = self._distance(key, match, limit)
+                if distance < best_distance:
+                    best_distance, best = distance, [match]
+                elif distance == best_distance:
+                    best.append(match)
+            return self._names[best[0]] if len(best) == 1 else None
+    
+    def seed(self, paths):
+        """Import names from past reports (JSON) and results files (CSV) not imported yet"""
+        imported = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if self._sources.get(path) == mtime:
+                continue
+            
+            try:
+                if path.lower().endswith('.csv'):
+                    with open(path, 'r', encoding='utf-8', newline='') as f:
+                        names = [row.get('recipient_name') for row in csv.DictReader(f)]
+                else:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        names = [r.get('customer_name') for r in json.load(f) if self.is_learnable(r)]
+            except ValueError:
+                continue  # unreadable report (e.g. from a crashed older version); skip it quietly
+            except (OSError, AttributeError) as e:
+                print(f"⚠️  Could not import customers from {os.path.basename(path)}: {e}")
+                continue
+            
+            with self._lock:
+                for name in names:
+                    if name:
+                        self._add(name)
+                        imported += 1
+                self._sources[path] = mtime
+                self._dirty = True
+        return imported
+    
+    def mark_imported(self, path):
+        """Record a report whose names were already added live, so seed skips it"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._sources[path] = os.path.getmtime(path)
+            self._dirty = True
+    
+    def save(self):
+        """Write the index back to disk if it changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                'customers': {self._names[key]: count for key, count in self._counts.items()},
+                'sources': self._sources
+            }
+            self._dirty = False
+        
+        tmp_path = f"{self.index_file}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.index_file)
+        except OSError as e:
+            print(f"⚠️  Could not save customer index: {e}")
+
+
+class ExtractionMemo:
+    """Persistent memo of name extraction results keyed by document content and config
+
+    Keys hash the OCR lines, confidences and bounding boxes. The file starts
+    with a fingerprint of the configuration that drives extraction; when it
+    no longer matches, the memo starts empty, so a config change invalidates
+    every entry without any bookkeeping. New entries are appended as JSON
+    lines on save.
+    """
+    
+    # Bump when extraction logic changes in a way the config fingerprint can't see
+    VERSION = 2
+    
+    def __init__(self, memo_file, fingerprint):
+        self.memo_file = memo_file
+        self.fingerprint = f"{self.VERSION}-{fingerprint}"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> [customer_name, path, rejected]
+        self._pending = []  # entries not yet written
+        self._rewrite = True
+        
+        try:
+            with open(memo_file, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline() or '{}')
+                if header.get('fingerprint') == self.fingerprint:
+                    for line in f:
+                        try:
+                            key, value = json.loads(line)
+                        except ValueError:
+                            continue  # torn last line from an interrupted run
+                        self._entries[key] = value
+                    self._rewrite = False
+        except (OSError, ValueError):
+            pass
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    @staticmethod
+    def make_key(document):
+        """Hash of a document's lines, confidences, boxes and pages"""
+        digest = hashlib.sha256('\n'.join(document.lines).encode('utf-8'))
+        digest.update(array('f', document.confidences).tobytes())
+        digest.update(array('f', document.boxes).tobytes())
+        digest.update(array('H', document.pages).tobytes())
+        return digest.hexdigest()
+    
+    def get(self, key):
+        """Return (customer_name, path, rejected) for a key, or None on a miss"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        customer_name, path, rejected = value
+        return customer_name, path, [tuple(r) for r in rejected]
+    
+    def put(self, key, customer_name, path, rejected):
+        """Record the result of extracting a document"""
+        value = [customer_name, path, [list(r) for r in rejected]]
+        with self._lock:
+            self._entries[key] = value
+            self._pending.append((key, value))
+    
+    def reset_stats(self):
+        """Reset hit and miss counters"""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+    
+    def save(self):
+        """Append new entries, or rewrite the file for a new fingerprint"""
+        with self._lock:
+            if self._rewrite:
+                mode, entries = 'w', list(self._entries.items())
+            else:
+                mode, entries = 'a', self._pending
+            if not entries and not self._rewrite:
+                return
+            self._pending = []
+            self._rewrite = False
+        
+        try:
+            with open(self.memo_file, mode, encoding='utf-8') as f:
+                if mode == 'w':
+                    f.write(json.dumps({'fingerprint': self.fingerprint}) + '\n')
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"⚠️  Could not save extraction memo: {e}")
+
+
+class ReceiptTrace:
+    """Debug events for one receipt, buffered in memory and written once per file
+
+    Callers keep the trace in a local that is None when debug_mode is off,
+    so the hot path pays a single identity check and never formats messages.
+    """
+    
+    __slots__ = ('file_name', 'events', '_start')
+    
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.events = []
+        self._start = time.perf_counter()
+    
+    def __call__(self, event, **fields):
+        """Record an event with structured fields"""
+        self.events.append((time.perf_counter() - self._start, event, fields))
+    
+    def write(self, trace_dir):
+        """Write the buffered events as JSON lines to trace_dir/<file>.trace.jsonl"""
+        path = os.path.join(trace_dir, f"{self.file_name}.trace.jsonl")
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                for elapsed, event, fields in self.events:
+                    record = {'t': round(elapsed, 6), 'event': event, **fields}
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            print(f"⚠️  Could not write trace for {self.file_name}: {e}")
+
+
+RECEIPT_SUFFIXES = frozenset({'.jpg', '.jpeg', '.png', '.pdf'})
+
+# Leading bytes of JPEG, PNG and PDF files -> the extension they should carry
+RECEIPT_MAGIC = {b'\xff\xd8\xff': '.jpg', b'\x89PNG\r\n\x1a\n': '.png', b'%PDF': '.pdf'}
+
+
+def receipt_extension(path, sniff=True):
+    """
+    Classify a file as a receipt and return the extension it should have
+    
+    Files with a receipt suffix keep it (as written); for any other file the
+    first bytes decide, so an extensionless JPEG or a PDF saved as .txt is
+    found and gets .jpg or .pdf when renamed.
+    
+    Returns:
+        The extension, or None when the file isn't a receipt
+    """
+    suffix = os.path.splitext(path)[1]
+    if suffix.lower() in RECEIPT_SUFFIXES:
+        return suffix
+    if not sniff:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(8)
+    except OSError:
+        return None
+    for magic, extension in RECEIPT_MAGIC.items():
+        if head.startswith(magic):
+            return extension
+    return None
+
+
+def scan_receipt_files(folder_path, recursive=False, sniff=True):
+    """
+    Yield receipt file paths as the directory is read
+
+    One os.scandir pass per directory, no sorting and no list, so the first
+    file is available immediately and memory stays flat however large the
+    folder is. Hidden entries (the OCR cache, journals, traces) are skipped.
+
+    Args:
+        folder_path: Folder to scan
+        recursive: Also scan subfolders
+        sniff: Check the magic bytes of files whose suffix isn't a known receipt type
+    """
+    pending = [folder_path]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive:
+                                pending.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+                    if receipt_extension(entry.path, sniff) is not None:
+                        yield entry.path
+        except OSError as e:
+            print(f"⚠️  Could not scan {directory}: {e}")
+
+
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+
+
+def _load_renameat2():
+    """Return libc's renameat2 on Linux, or None where it isn't available"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return None  # glibc < 2.28 or a libc without the wrapper
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    renameat2.restype = ctypes.c_int
+    return renameat2
+
+
+_renameat2 = _load_renameat2()
+
+
+def rename_noreplace(src, dst):
+    """
+    Rename src to dst, raising FileExistsError instead of overwriting dst
+
+    Uses renameat2(RENAME_NOREPLACE) on Linux. Elsewhere, or on filesystems
+    that don't support the flag, falls back to a hard link plus unlink, and
+    on Windows to os.rename, which already refuses existing targets.
+    """
+    if _renameat2 is not None:
+        if _renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dst), RENAME_NOREPLACE) == 0:
+            return
+        err = ctypes.get_errno()
+        if err == errno.EEXIST:
+            raise FileExistsError(err, os.strerror(err), dst)
+        if err not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+            raise OSError(err, os.strerror(err), src)
+
+    if os.name == 'nt':
+        os.rename(src, dst)
+        return
+
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        # No hard links on this filesystem (e.g. FAT); check-then-rename
+        if os.path.lexists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst)
+        return
+    os.unlink(src)
+
+
+class RenamePlanner:
+    """Collision-free target names from one listing per directory
+
+    Each directory is listed once into a set of lowercased names (so
+    case-insensitive filesystems can't collide either), and a hint per
+    (stem, extension) remembers the next free numeric suffix, so picking a
+    name is a few set lookups however many earlier receipts share it.
+    Names are reserved under a lock, which lets worker threads rename in
+    parallel; the rename itself never overwrites, so a file created behind
+    the planner's back just costs a retry with the next suffix.
+    """
+
+    _SUFFIX_RE = re.compile(r'^(.*)_(\d+)$')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = {}     # directory -> lowercased names present or reserved
+        self._next = {}      # (directory, stem, ext) lowercased -> next suffix to try
+        self._reserved = set()  # absolute paths handed out as rename targets
+
+    def reset(self):
+        """Forget listings and reservations (the folder may have changed)"""
+        with self._lock:
+            self._names.clear()
+            self._next.clear()
+            self._reserved.clear()
+
+    def _listing(self, directory):
+        """Lowercased names in directory, listed once; seeds the suffix hints"""
+        names = self._names.get(directory)
+        if names is None:
+            try:
+                names = {name.lower() for name in os.listdir(directory or '.')}
+            except OSError:
+                names = set()
+            self._names[directory] = names
+            for name in names:
+                stem, ext = os.path.splitext(name)
+                match = self._SUFFIX_RE.match(stem)
+                if match:
+                    key = (directory, match.group(1), ext)
+                    self._next[key] = max(self._next.get(key, 1), int(match.group(2)) + 1)
+        return names
+
+    def reserve(self, directory, stem, extension):
+        """Reserve and return a free name: stem+ext, else stem_N+ext"""
+        with self._lock:
+            names = self._listing(directory)
+            name = f"{stem}{extension}"
+            if name.lower() in names:
+                key = (directory, stem.lower(), extension.lower())
+                counter = self._next.get(key, 1)
+                while f"{stem}_{counter}{extension}".lower() in names:
+                    counter += 1
+                self._next[key] = counter + 1
+                name = f"{stem}_{counter}{extension}"
+            names.add(name.lower())
+            self._reserved.add(os.path.abspath(os.path.join(directory, name)))
+            return name
+
+    def release(self, directory, name):
+        """Give back a reserved name whose rename failed"""
+        with self._lock:
+            self._names.get(directory, set()).discard(name.lower())
+            self._reserved.discard(os.path.abspath(os.path.join(directory, name)))
+
+    def is_reserved(self, path):
+        """Whether path was handed out as a rename target during this run"""
+        with self._lock:
+            return os.path.abspath(path) in self._reserved
+
+    def rename(self, file_path, stem, extension, journal=None):
+        """
+        Move file_path to a free stem[_N]+extension name in its directory
+        
+        Args:
+            file_path: File to rename
+            stem, extension: Parts of the target name
+            journal: Optional RenameJournal logging the rename ahead of time
+            
+        Returns:
+            The new filename
+        """
+        directory = os.path.dirname(file_path)
+        while True:
+            name = self.reserve(directory, stem, extension)
+            new_path = os.path.join(directory, name)
+            entry = journal.plan(file_path, new_path) if journal is not None else None
+            try:
+                rename_noreplace(file_path, new_path)
+            except FileExistsError:
+                if entry is not None:
+                    journal.abort(entry)
+                continue  # appeared since the listing; stays marked as taken
+            except OSError:
+                if entry is not None:
+                    journal.abort(entry)
+                self.release(directory, name)
+                raise
+
+            if entry is not None:
+                journal.done(entry)
+            with self._lock:
+                old_name = os.path.basename(file_path).lower()
+                if old_name != name.lower():
+                    self._names[directory].discard(old_name)
+            return name
+
+
+class RenameJournal:
+    """Append-only write-ahead log of renames in a receipt folder
+
+    A 'plan' record is fsynced before each rename and a 'done' record is
+    appended after it. Concurrent callers share fsyncs (group commit): one
+    thread flushes everything buffered so far while the others wait for it,
+    and 'done' records ride along with the next flush. After a crash,
+    recover() settles unfinished plans by looking at the two paths, so the
+    original -> new mapping is never lost, and undo() replays completed
+    renames backwards.
+
+    Records are JSON lines: {"run", "id", "op", "src", "dst"}, where op is
+    plan, done, abort or undo and paths are relative to the folder.
+    """
+
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.directory = os.path.dirname(os.path.abspath(journal_file))
+        self.run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}-{os.getpid()}"
+        self._cond = threading.Condition()
+        self._buffer = []
+        self._seq = 0       # records appended to the buffer
+        self._synced = 0    # records known to be on disk
+        self._syncing = False
+        self._next_id = 0
+        self._file = open(journal_file, 'a', encoding='utf-8')
+
+    def close(self):
+        """Flush pending records and close the file"""
+        self.sync()
+        self._file.close()
+
+    def _append(self, record, durable):
+        """Buffer a record; when durable, return only once it is fsynced"""
+        with self._cond:
+            self._buffer.append(json.dumps(record, ensure_ascii=False) + '\n')
+            self._seq += 1
+            if durable:
+                self._commit(self._seq)
+
+    def _commit(self, seq):
+        """Wait until record seq is on disk, flushing as the group leader if nobody else is"""
+        while self._synced < seq:
+            if self._syncing:
+                self._cond.wait()
+                continue
+            self._syncing = True
+            lines, self._buffer = self._buffer, []
+            upto = self._seq
+            self._cond.release()
+            try:
+                self._file.write(''.join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            finally:
+                self._cond.acquire()
+                self._syncing = False
+                self._cond.notify_all()
+            self._synced = upto
+
+    def sync(self):
+        """Make every record appended so far durable"""
+        with self._cond:
+            self._commit(self._seq)
+
+    def _relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.directory)
+
+    def plan(self, src, dst):
+        """Durably log an intended rename; returns the entry id"""
+        with self._cond:
+            self._next_id += 1
+            entry = self._next_id
+        self._append({'run': self.run_id, 'id': entry, 'op': 'plan',
+                      'src': self._relative(src), 'dst': self._relative(dst)}, durable=True)
+        return entry
+
+    def done(self, entry):
+        """Log a completed rename (flushed with the next group commit)"""
+        self._append({'run': self.run_id, 'id': entry, 'op': 'done'}, durable=False)
+
+    def abort(self, entry):
+        """Log a planned rename that did not happen"""
+        self._append({'run': self.run_id, 'id': entry, 'op': 'abort'}, durable=False)
+
+    def replay(self):
+        """
+        Fold the journal into its renames, in the order they were planned
+
+        Returns:
+            List of dicts with run, id, src, dst and state (the last op seen)
+        """
+        self.sync()
+        entries = {}
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a crash
+                    key = (record['run'], record['id'])
+                    if record['op'] == 'plan':
+                        entries[key] = {'run': record['run'], 'id': record['id'],
+                                        'src': record['src'], 'dst': record['dst'], 'state': 'plan'}
+                    elif key in entries:
+                        entries[key]['state'] = record['op']
+        except OSError:
+            pass
+        return list(entries.values())
+
+    def recover(self):
+        """
+        Settle renames planned by an interrupted run by checking the filesystem
+
+        Returns:
+            List of (src, dst) renames that had completed
+        """
+        completed = []
+        for e in self.replay():
+            if e['state'] != 'plan' or e['run'] == self.run_id:
+                continue
+            src = os.path.join(self.directory, e['src'])
+            dst = os.path.join(self.directory, e['dst'])
+            record = {'run': e['run'], 'id': e['id']}
+
+            if os.path.exists(src) and os.path.exists(dst) and os.path.samefile(src, dst):
+                os.unlink(src)  # interrupted between link and unlink
+            if os.path.exists(dst) and not os.path.exists(src):
+                self._append(dict(record, op='done'), durable=False)
+                completed.append((e['src'], e['dst']))
+            else:
+                self._append(dict(record, op='abort'), durable=False)
+        self.sync()
+        return completed
+
+    def undo(self, all_runs=False):
+        """
+        Revert completed renames, newest first
+
+        Args:
+            all_runs: Revert every run in the journal, not just the latest one
+
+        Returns:
+            Number of files restored to their original names
+        """
+        self.recover()
+        done = [e for e in self.replay() if e['state'] == 'done']
+        if not all_runs and done:
+            done = [e for e in done if e['run'] == done[-1]['run']]
+
+        restored = 0
+        for e in reversed(done):
+            src = os.path.join(self.directory, e['src'])
+            dst = os.path.join(self.directory, e['dst'])
+            try:
+                rename_noreplace(dst, src)
+            except OSError as err:
+                print(f"  ✗ {e['dst']} → {e['src']}: {err}")
+                continue
+            self._append({'run': e['run'], 'id': e['id'], 'op': 'undo'}, durable=True)
+            print(f"  ✓ {e['dst']} → {e['src']}")
+            restored += 1
+        return restored
+
+
+class ProcessingCheckpoint:
+    """Outcome of every finished file in a folder, for resuming interrupted runs
+
+    Entries are keyed by (name, size, mtime_ns), so deciding whether a file
+    can be skipped costs one stat and one dict lookup. Renamed files are
+    recorded under their new name, which keeps size and mtime. Each record
+    is flushed as soon as the file finishes, so an interruption loses at
+    most the files in flight.
+    """
+
+    def __init__(self, checkpoint_file, resume=False):
+        self.checkpoint_file = checkpoint_file
+        self._lock = threading.Lock()
+        self._entries = {}  # stat key -> record
+
+        if resume:
+            try:
+                with open(checkpoint_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue  # torn last line from an interrupted run
+                        self._entries[record['key']] = record
+            except OSError:
+                pass
+
+        # A fresh run starts a fresh checkpoint
+        self._file = open(checkpoint_file, 'a' if resume else 'w', encoding='utf-8')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    @staticmethod
+    def stat_key(path):
+        """(name, size, mtime_ns) of a file as a string key"""
+        st = os.stat(path)
+        return f"{os.path.basename(path)}|{st.st_size}|{st.st_mtime_ns}"
+
+    @staticmethod
+    def is_final(result):
+        """Whether a result should not be retried: successes and permanent failures"""
+        if result['status'] == 'rename_failed':
+            return False  # usually the file was open in another program
+        if result['status'] == 'error':
+            return not result.get('retryable', False)
+        return True
+
+    def is_done(self, path):
+        """Whether a file already finished with a final outcome"""
+        try:
+            key = self.stat_key(path)
+        except OSError:
+            return False
+        return key in self._entries
+
+    def record(self, file_path, result):
+        """Record a finished file (under its new name if it was renamed)"""
+        if not self.is_final(result):
+            return
+        if result.get('new_filename'):
+            file_path = os.path.join(os.path.dirname(file_path), result['new_filename'])
+
+        try:
+            record = {
+                'key': self.stat_key(file_path),
+                'status': result['status'],
+                'original_file': result.get('original_file'),
+                'new_filename': result.get('new_filename'),
+                'customer_name': result.get('customer_name')
+            }
+        except OSError:
+            return  # moved or deleted since; it will simply be processed again
+
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._entries[record['key']] = record
+            try:
+                self._file.write(line)
+                self._file.flush()
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not write checkpoint: {e}")
+
+
+class StreamingReport:
+    """Processing report written to disk as results arrive
+
+    Successful results are written straight away and only counted, so a run
+    holds no per-file state for them. Other results stay with the caller
+    (interactive review may still change them) and are written on close.
+    The file is the same JSON array as before, so past-report readers work
+    unchanged.
+    """
+
+    # Successful renames listed in the summary; the rest are in the report
+    LISTED_SUCCESSES = 50
+
+    def __init__(self, report_path):
+        self.report_path = report_path
+        self.successes = 0
+        self.path_counts = {}
+        self.text_layer = 0
+        self.listed = []  # (original_file, new_filename) for the summary
+        self._written = 0
+        # Written under a temporary name so readers never see a half report
+        self._part_path = f"{report_path}.part"
+        self._file = open(self._part_path, 'w', encoding='utf-8')
+        self._file.write('[')
+
+    def _write(self, result):
+        entry = json.dumps(result, indent=2, ensure_ascii=False).replace('\n', '\n  ')
+        self._file.write((',\n  ' if self._written else '\n  ') + entry)
+        self._written += 1
+
+    def count(self, result):
+        """Add a result's extraction path and OCR source to the summary counters"""
+        if result.get('extraction_path'):
+            self.path_counts[result['extraction_path']] = self.path_counts.get(result['extraction_path'], 0) + 1
+        if result.get('ocr_source') == 'pdf_text_layer':
+            self.text_layer += 1
+
+    def add_success(self, result):
+        """Write and count a successful result"""
+        self._write(result)
+        self.successes += 1
+        self.count(result)
+        if len(self.listed) < self.LISTED_SUCCESSES:
+            self.listed.append((result['original_file'], result['new_filename']))
+
+    def close(self, remaining):
+        """Write (and count) the results held back by the caller and finish the file"""
+        for result in remaining:
+            self._write(result)
+            self.count(result)
+        self._file.write('\n]' if self._written else ']')
+        self._file.close()
+        os.replace(self._part_path, self.report_path)
+
+
+class TextractThrottledError(Exception):
+    """Raised when a Textract call is still throttled after all retries"""
+
+
+# Error codes Textract returns when the account's TPS quota is exceeded
+THROTTLING_ERROR_CODES = {
+    'ThrottlingException',
+    'ProvisionedThroughputExceededException',
+    'LimitExceededException',
+    'TooManyRequestsException',
+}
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by all workers, tuned with AIMD
+    
+    The rate grows additively while calls succeed (about `increase` TPS per
+    second of successful traffic) and halves on throttling, so the processor
+    settles just under the account's quota without hand-tuning MAX_WORKERS.
+    """
+    
+    def __init__(self, initial_rate, min_rate, max_rate, increase):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.rate = max(min_rate, min(initial_rate, max_rate))
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+    
+    def _reserve(self):
+        """Take one token and return how long the caller must wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            capacity = max(1.0, self.rate)
+            self._tokens = min(capacity, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            self._tokens -= 1.0
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+    
+    def acquire(self):
+        """Block until a request may be sent"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+    
+    async def acquire_async(self):
+        """Wait on the event loop until a request may be sent"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+    
+    def on_success(self):
+        """Additive increase"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+    
+    def on_throttle(self):
+        """Multiplicative decrease, at most once per second for a burst of throttles"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < 1.0:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+
+def is_throttling_error(error):
+    """Check whether a boto exception is a Textract throttling error"""
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+    return False
+
+
+def is_transient_error(error):
+    """Check whether a failure may go away on a later run (throttling, timeouts, connectivity)"""
+    if isinstance(error, (TextractThrottledError, ConnectionError, TimeoutError, BotoCoreError)):
+        return True
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return is_throttling_error(error) or status >= 500
+    return False
+
+
+# Textract's limit for documents sent as raw bytes
+TEXTRACT_MAX_BYTES = 5 * 1024 * 1024
+
+
+def prepare_image_for_ocr(image_bytes, max_edge=2000, quality=80):
+    """
+    Downscale and re-encode an image to a compact grayscale JPEG for upload
+    
+    JPEGs are decoded in draft mode, letting libjpeg scale down during
+    decoding. PDFs, unreadable images and images that would not get smaller
+    are returned unchanged.
+    """
+    if image_bytes[:4] == b'%PDF':
+        return image_bytes
+    
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        if img.format == 'JPEG':
+            img.draft('L', (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+            # Transparent pixels would turn black in grayscale; put them on white paper
+            img = img.convert('RGBA')
+            img = Image.alpha_composite(Image.new('RGBA', img.size, 'white'), img)
+        if img.mode != 'L':
+            img = img.convert('L')
+        
+        output = io.BytesIO()
+        img.save(output, 'JPEG', quality=quality, optimize=True)
+        data = output.getvalue()
+    except Exception:
+        return image_bytes
+    
+    if len(data) >= len(image_bytes) and len(image_bytes) <= TEXTRACT_MAX_BYTES:
+        return image_bytes
+    return data
+
+
+class OCRBackend:
+    """Base class for OCR engines that turn document bytes into compact LINE blocks"""
+    
+    name = None
+    
+    def detect_lines(self, image_bytes):
+        """Return a list of {'Text', 'Confidence', 'BoundingBox'} dicts in reading order"""
+        raise NotImplementedError
+    
+    async def adetect_lines(self, image_bytes, executor=None):
+        """Async counterpart of detect_lines, run on an executor by default"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.detect_lines, image_bytes)
+    
+    def close(self):
+        """Release any resources held by the backend"""
+
+
+class TextractBackend(OCRBackend):
+    """
+    AWS Textract detect_document_text, behind the shared rate limiter
+    
+    The botocore client makes a single attempt per call; retries happen
+    here. Throttling backs off through the shared AIMD rate limiter (up to
+    throttle_retries times), other transient failures (5xx, timeouts,
+    dropped connections) are retried up to error_retries times with
+    exponential backoff.
+    """
+    
+    name = 'textract'
+    
+    def __init__(self, client, rate_limiter, throttle_retries=10, error_retries=3,
+                 preprocess=True, max_edge=2000, jpeg_quality=80):
+        self.client = client
+        self.aio_client = None  # set by aprocess_folder when aiobotocore is available
+        self.rate_limiter = rate_limiter
+        self.throttle_retries = throttle_retries
+        self.error_retries = error_retries
+        self.preprocess = preprocess
+        self.max_edge = max_edge
+        self.jpeg_quality = jpeg_quality
+    
+    def prepare_upload(self, image_bytes):
+        """Shrink an image before upload when preprocessing is enabled"""
+        if not self.preprocess:
+            return image_bytes
+        return prepare_image_for_ocr(image_bytes, self.max_edge, self.jpeg_quality)
+    
+    def _retry_delay(self, error, attempts):
+        """
+        Seconds to wait before retrying a failed call, or None to give up
+        
+        Args:
+            error: The exception the call raised
+            attempts: Dict counting earlier 'throttle' and 'error' retries
+        """
+        if is_throttling_error(error):
+            self.rate_limiter.on_throttle()
+            attempts['throttle'] += 1
+            if attempts['throttle'] > self.throttle_retries:
+                raise TextractThrottledError(f"Textract throttled after {self.throttle_retries} retries") from error
+            return 0.0  # the rate limiter already spaces the retry
+        if not is_transient_error(error) or attempts['error'] >= self.error_retries:
+            return None
+        attempts['error'] += 1
+        return random.uniform(0, 0.5 * 2 ** attempts['error'])
+    
+    def detect_lines(self, image_bytes):
+        image_bytes = self.prepare_upload(image_bytes)
+        attempts = {'throttle': 0, 'error': 0}
+        
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = self.client.detect_document_text(
+                    Document={'Bytes': image_bytes}
+                )
+            except Exception as e:
+                delay = self._retry_delay(e, attempts)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            
+            self.rate_limiter.on_success()
+            return self.line_blocks_from_response(response)
+    
+    async def adetect_lines(self, image_bytes, executor=None):
+        if self.aio_client is None:
+            return await super().adetect_lines(image_bytes, executor)
+        
+        # Image decoding is CPU-bound, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        image_bytes = await loop.run_in_executor(None, self.prepare_upload, image_bytes)
+        
+        attempts = {'throttle': 0, 'error': 0}
+        
+        while True:
+            await self.rate_limiter.acquire_async()
+            try:
+                response = await self.aio_client.detect_document_text(
+                    Document={'Bytes': image_bytes}
+                )
+            except Exception as e:
+                delay = self._retry_delay(e, attempts)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            
+            self.rate_limiter.on_success()
+            return self.line_blocks_from_response(response)
+    
+    @staticmethod
+    def line_blocks_from_response(response):
+        """Keep only LINE blocks, without relationships and polygons"""
+        blocks = []
+        for block in response['Blocks']:
+            if block['BlockType'] == 'LINE':
+                blocks.append({
+                    'Text': block['Text'],
+                    'Confidence': block.get('Confidence'),
+                    'BoundingBox': block.get('Geometry', {}).get('BoundingBox')
+                })
+        return blocks
+
+
+class PyMuPDFTextBackend(OCRBackend):
+    """Reads the embedded text layer of PDFs; returns nothing for images"""
+    
+    name = 'pymupdf'
+    
+    def detect_lines(self, image_bytes):
+        if image_bytes[:4] != b'%PDF':
+            return []
+        
+        blocks = []
+        with fitz.open(stream=image_bytes, filetype='pdf') as doc:
+            for page_num, page in enumerate(doc):
+                width, height = page.rect.width or 1, page.rect.height or 1
+                page_dict = page.get_text('dict')
+                
+                for block in page_dict['blocks']:
+                    if block.get('type') != 0:  # 0 = text, 1 = image
+                        continue
+                    for line in block['lines']:
+                        text = ''.join(span['text'] for span in line['spans']).strip()
+                        if not text:
+                            continue
+                        x0, y0, x1, y1 = line['bbox']
+                        blocks.append({
+                            'Text': text,
+                            'Confidence': 100.0,
+                            'BoundingBox': {
+                                'Left': x0 / width,
+                                'Top': y0 / height,
+                                'Width': (x1 - x0) / width,
+                                'Height': (y1 - y0) / height
+                            },
+                            'Page': page_num + 1
+                        })
+        return blocks
+
+
+class TesseractBackend(OCRBackend):
+    """
+    Local Tesseract OCR, batching many images into one tesseract invocation
+    
+    Loading the language data dominates tesseract's per-call cost, so
+    concurrent requests are collected for up to batch_wait seconds (or
+    batch_size images) and run as a single multi-image job through a list
+    file. Up to `workers` jobs run at once. Batches only fill when callers
+    submit images concurrently, so the processor runs at least batch_size
+    OCR workers with this backend. A failed batch is re-run image by image,
+    so one unreadable image doesn't fail the others.
+    """
+    
+    name = 'tesseract'
+    
+    def __init__(self, tesseract_cmd='tesseract', lang='eng', batch_size=16,
+                 batch_wait=0.05, workers=2, pdf_dpi=200):
+        self.tesseract_cmd = tesseract_cmd
+        self.lang = lang
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.pdf_dpi = pdf_dpi
+        self.workers = workers
+        self._queue = None
+        self._runner = None
+        self._dispatcher = None
+        self._lock = threading.Lock()
+    
+    def detect_lines(self, image_bytes):
+        future = Future()
+        
+        with self._lock:
+            if self._dispatcher is None:
+                # Each dispatcher gets its own queue, so one stopped by close() can't take new work
+                self._queue = queue.Queue()
+                self._runner = ThreadPoolExecutor(max_workers=self.workers)
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, args=(self._queue, self._runner),
+                                                    daemon=True)
+                self._dispatcher.start()
+            self._queue.put((image_bytes, future))
+        
+        return future.result()
+    
+    def _dispatch_loop(self, requests, runner):
+        """Group queued requests into batches and hand them to the runner pool"""
+        while True:
+            item = requests.get()
+            if item is None:
+                return
+            
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    requests.put(None)
+                    break
+                batch.append(item)
+            
+            runner.submit(self._run_batch, batch)
+    
+    def _to_image_bytes(self, data):
+        """Tesseract cannot read PDFs, so render their first page to PNG"""
+        if data[:4] != b'%PDF':
+            return data
+        with fitz.open(stream=data, filetype='pdf') as doc:
+            return doc[0].get_pixmap(dpi=self.pdf_dpi).tobytes('png')
+    
+    def _run_batch(self, batch):
+        try:
+            with tempfile.TemporaryDirectory(prefix='receipt_tesseract_') as tmp_dir:
+                image_paths = []
+                for i, (data, _) in enumerate(batch):
+                    path = os.path.join(tmp_dir, f"{i:05d}.img")
+                    with open(path, 'wb') as f:
+                        f.write(self._to_image_bytes(data))
+                    image_paths.append(path)
+                
+                list_path = os.path.join(tmp_dir, 'batch.txt')
+                with open(list_path, 'w', encoding='utf-8') as f:
+                    f.write('\n'.join(image_paths) + '\n')
+                
+                completed = subprocess.run(
+                    [self.tesseract_cmd, list_path, 'stdout', '-l', self.lang, 'tsv'],
+                    capture_output=True, check=True
+                )
+            
+            pages = self.parse_tsv(completed.stdout.decode('utf-8', errors='replace'))
+            for i, (_, future) in enumerate(batch, 1):
+                future.set_result(pages.get(i, []))
+        except Exception as e:
+            if len(batch) > 1:
+                # Find the image that failed; the rest still get their text
+                for item in batch:
+                    self._run_batch([item])
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+    
+    @staticmethod
+    def parse_tsv(tsv):
+        """Turn tesseract TSV output into LINE blocks per page (1-based)"""
+        pages = {}
+        page_sizes = {}
+        lines = OrderedDict()  # (page, block, par, line) -> [bbox, words, confidences]
+        
+        for row in tsv.splitlines()[1:]:
+            cols = row.split('\t')
+            if len(cols) < 12:
+                continue
+            level, page = int(cols[0]), int(cols[1])
+            key = (page, int(cols[2]), int(cols[3]), int(cols[4]))
+            left, top, width, height = (int(c) for c in cols[6:10])
+            
+            if level == 1:
+                page_sizes[page] = (width or 1, height or 1)
+            elif level == 4:
+                lines[key] = [(left, top, width, height), [], []]
+            elif level == 5 and cols[11].strip() and key in lines:
+                lines[key][1].append(cols[11].strip())
+                lines[key][2].append(float(cols[10]))
+        
+        for (page, _, _, _), (bbox, words, confidences) in lines.items():
+            if not words:
+                continue
+            page_width, page_height = page_sizes.get(page, (1, 1))
+            left, top, width, height = bbox
+            pages.setdefault(page, []).append({
+                'Text': ' '.join(words),
+                'Confidence': sum(confidences) / len(confidences),
+                'BoundingBox': {
+                    'Left': left / page_width,
+                    'Top': top / page_height,
+                    'Width': width / page_width,
+                    'Height': height / page_height
+                }
+            })
+        
+        return pages
+    
+    def close(self):
+        """Stop the dispatcher and runner pool (restarted by the next detect_lines)"""
+        with self._lock:
+            if self._dispatcher is not None:
+                self._queue.put(None)
+                self._dispatcher = None
+                self._runner.shutdown(wait=False)
+                self._runner = None
+
+
+class ReceiptPipeline:
+    """
+    Staged executor: read → OCR → extract → rename
+    
+    Each stage has its own thread pool and bounded input queue, so disk
+    reads and renames never hold OCR slots, and the read stage prefetches
+    the next files' bytes while OCR requests are in flight. Files answered
+    by the PDF text layer or the OCR cache bypass the OCR stage.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, processor, read_workers=2, ocr_workers=3, extract_workers=1,
+                 rename_workers=1, queue_size=16):
+        self.processor = processor
+        self.stage_workers = {
+            'read': read_workers,
+            'ocr': ocr_workers,
+            'extract': extract_workers,
+            'rename': rename_workers,
+        }
+        self.queues = {stage: queue.Queue(maxsize=queue_size) for stage in self.stage_workers}
+        self.results = queue.Queue()
+    
+    def run(self, files):
+        """Process files and yield (index, file_path, result) as files complete"""
+        handlers = {
+            'read': self._read,
+            'ocr': self._ocr,
+            'extract': self._extract,
+            'rename': self._rename,
+        }
+        threads = []
+        for stage, workers in self.stage_workers.items():
+            for _ in range(workers):
+                thread = threading.Thread(target=self._worker, args=(stage, handlers[stage]), daemon=True)
+                thread.start()
+                threads.append(thread)
+        
+        feeder = threading.Thread(target=self._feed, args=(files,), daemon=True)
+        feeder.start()
+        
+        expected = None
+        completed = 0
+        while expected is None or completed < expected:
+            item = self.results.get()
+            if isinstance(item, int):
+                expected = item
+                continue
+            completed += 1
+            yield item
+        
+        for stage, workers in self.stage_workers.items():
+            for _ in range(workers):
+                self.queues[stage].put(self._STOP)
+        for thread in threads:
+            thread.join()
+    
+    def _feed(self, files):
+        count = 0
+        for count, file_path in enumerate(files, 1):
+            self.queues['read'].put({'index': count, 'file_path': str(file_path)})
+        self.results.put(count)
+    
+    def _worker(self, stage, handler):
+        stage_queue = self.queues[stage]
+        while True:
+            job = stage_queue.get()
+            if job is self._STOP:
+                return
+            try:
+                next_stage = handler(job)
+            except Exception as e:
+                print(f"  ✗ Error: {e}")
+                job['result'] = {
+                    'original_file': os.path.basename(job['file_path']),
+                    'status': 'error',
+                    'error': str(e),
+                    'retryable': is_transient_error(e),
+                    'timestamp': datetime.now().isoformat()
+                }
+                next_stage = None
+            
+            if next_stage is None:
+                self.processor.finish_trace(job.get('trace'), job['result'])
+                self.results.put((job['index'], job['file_path'], job['result']))
+            else:
+                self.queues[next_stage].put(job)
+    
+    def _read(self, job):
+        processor = self.processor
+        processor._print_file_header(os.path.basename(job['file_path']))
+        trace = job['trace'] = processor.start_trace(job['file_path'])
+        try:
+            image_bytes, cache_key, blocks, source = processor._read_and_lookup(job['file_path'], trace)
+        except Exception as e:
+            if trace is not None:
+                trace('read_error', error=str(e))
+            raise
+        
+        job['bytes'], job['cache_key'], job['blocks'], job['ocr_source'] = image_bytes, cache_key, blocks, source
+        return 'ocr' if blocks is None else 'extract'
+    
+    def _ocr(self, job):
+        processor = self.processor
+        image_bytes, job['bytes'] = job['bytes'], None
+        try:
+            blocks = processor._detect_line_blocks(image_bytes)
+            processor._store_line_blocks(job['cache_key'], blocks)
+            job['blocks'], job['ocr_source'] = blocks, processor.ocr_backend_name
+        except Exception as e:
+            if job['trace'] is not None:
+                job['trace']('ocr_error', error=str(e))
+            raise
+        return 'extract'
+    
+    def _extract(self, job):
+        customer_name, extraction_path, result = self.processor._analyze_line_blocks(
+            job['file_path'], job['blocks'], job['ocr_source'], job['trace']
+        )
+        job['blocks'] = None
+        if result is not None:
+            job['result'] = result
+            return None
+        job['customer_name'], job['extraction_path'] = customer_name, extraction_path
+        return 'rename'
+    
+    def _rename(self, job):
+        job['result'] = self.processor._rename_and_report(
+            job['file_path'], job['customer_name'], job['ocr_source'], job['extraction_path']
+        )
+        return None
+
 
 class MalaysianBankReceiptProcessor:
+    # Keep the OCR text of receipts without a name (for manual review)
+    keep_text = False
+    
     def __init__(self, config_file='bank_config.json', region_name='us-east-1'):
         """Initialize processor with configuration"""
         load_dotenv()
         
-        # Load AWS Textract client
-        self.textract = boto3.client(
-            'textract',
-            region_name=region_name,
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY')
-        )
-        
         # Load configuration from JSON file
         self.config = self.load_config(config_file)
         self.name_keywords = self.config.get('name_keywords', [])
@@ -27,12 +1946,130 @@ class MalaysianBankReceiptProcessor:
         self.excluded_words = self.config.get('excluded_words', [])
         self.settings = self.config.get('settings', {})
         
+        # Compile all keyword lists into one matcher at config load
+        self._name_keyword_order = [k.lower() for k in self.name_keywords if k]
+        self._name_keyword_set = set(self._name_keyword_order)
+        self._excluded_set = {word.lower() for word in self.excluded_words if word}
+        self.bank_index = self.build_bank_index(self.banks)
+        # indicator -> shorter indicators inside it ("originator" in "originator name"),
+        # and a matcher to tell those apart from standalone occurrences
+        self._bank_nested = {
+            indicator: frozenset(other for other in self.bank_index if other != indicator and other in indicator)
+            for indicator in self.bank_index
+        }
+        self.bank_matcher = KeywordMatcher(list(self.bank_index))
+        
+        # Extraction rules (see extraction_rules.py), compiled once
+        validators = {'name': self.validate_name}
+        self.bank_extractors = {
+            bank_name: compile_rule(dict({'name': bank_name, 'validate': 'name'}, **bank_config['extractor']), validators)
+            for bank_name, bank_config in self.banks.items()
+            if bank_config.get('extractor')
+        }
+        name_rule_specs = list(self.config.get('name_rules', []))
+        if self._name_keyword_order:
+            name_rule_specs.append({
+                'name': 'method1',
+                'anchor': self._name_keyword_order,
+                'offset': ['right', 'below', 1],
+                'validate': 'name'
+            })
+        self.name_rules = compile_rules(name_rule_specs, validators)
+        
+        # Method 2 strategy: 'heuristic' line rules or the trained 'scorer'
+        self.name_scorer = None
+        if self.settings.get('method2', 'heuristic') == 'scorer':
+            self.name_scorer = NameScorer.load(self.settings.get('name_scorer_model', 'name_scorer_model.json'))
+        self.keyword_matcher = KeywordMatcher(
+            self._name_keyword_order
+            + list(self._excluded_set)
+            + list(self.bank_index)
+            + [anchor for rule in list(self.bank_extractors.values()) + self.name_rules for anchor in rule.anchors]
+        )
+        
+        # Load AWS Textract client, shared by all workers (boto3 clients are thread-safe)
+        self.region_name = region_name
+        self.textract_pool_size = 0
+        self.textract = self.create_textract_client(max(
+            self.settings.get('parallel_workers', 3),
+            self.settings.get('async_max_in_flight', 64)
+        ))
+        
+        # Shared Textract rate limiter
+        self.rate_limiter = AdaptiveRateLimiter(
+            initial_rate=self.settings.get('textract_tps_initial', 5),
+            min_rate=self.settings.get('textract_tps_min', 0.5),
+            max_rate=self.settings.get('textract_tps_max', 25),
+            increase=self.settings.get('textract_tps_increase', 0.5)
+        )
+        
+        # OCR engine, selected by settings.ocr_backend
+        self.ocr_backend = self.create_ocr_backend(self.settings.get('ocr_backend', 'textract'))
+        self.ocr_backend_name = self.ocr_backend.name
+        
+        # PDFs with an embedded text layer skip OCR entirely
+        self.pdf_text_backend = PyMuPDFTextBackend()
+        
+        # OCR result cache (on by default)
+        self.ocr_cache = None
+        if self.settings.get('ocr_cache', True):
+            self.ocr_cache = OCRCache(
+                self.settings.get('ocr_cache_dir', '.ocr_cache'),
+                int(self.settings.get('ocr_cache_max_mb', 200) * 1024 * 1024)
+            )
+        
+        # Per-receipt debug traces, written to trace_dir when debug_mode is on
+        self.trace_dir = None
+        if self.settings.get('debug_mode'):
+            self.trace_dir = self.settings.get('trace_dir', '.receipt_traces')
+            os.makedirs(self.trace_dir, exist_ok=True)
+        
+        # Memo of extraction results, invalidated when the config changes
+        self.extraction_memo = None
+        if self.settings.get('extraction_memo', True):
+            self.extraction_memo = ExtractionMemo(
+                self.settings.get('extraction_memo_file', '.extraction_memo.jsonl'),
+                self.config_fingerprint()
+            )
+        
+        # Known customers, used to snap OCR-noisy names to a consistent spelling
+        self.customer_index = None
+        if self.settings.get('customer_index', True):
+            self.customer_index = CustomerIndex(
+                self.settings.get('customer_index_file', 'customer_index.json'),
+                self.settings.get('customer_index_max_distance', 2)
+            )
+        
+        # Target names reserved per directory, so renames never collide
+        self.rename_planner = RenamePlanner()
+        
+        # Write-ahead log of renames, opened per folder by start_rename_journal
+        self.rename_journal = None
+        
+        # Finished files of the current folder, for --resume
+        self.checkpoint = None
+        
+        # First-pass OCR text kept for the manual review screen
+        self.text_store = OCRTextStore(
+            int(self.settings.get('text_store_max_mb', 64) * 1024 * 1024)
+        )
+        
+        # Fallback executor for async OCR, set up by aprocess_folder
+        self._aio_executor = None
+        
         self.results = []
+        self.skipped_files = 0
+        self.renamed_count = 0
+        self.report = None
         
         print(f"✓ Configuration loaded from {config_file}")
         print(f"  - {len(self.name_keywords)} name keywords")
         print(f"  - {len(self.banks)} Malaysian banks configured")
-        print(f"  - Debug mode: {'ON' if self.settings.get('debug_mode') else 'OFF'}")
+        print(f"  - OCR backend: {self.ocr_backend_name}")
+        print(f"  - OCR cache: {'ON' if self.ocr_cache else 'OFF'}")
+        if self.customer_index is not None:
+            print(f"  - {len(self.customer_index)} known customers")
+        print(f"  - Debug mode: {f'ON (traces in {self.trace_dir})' if self.trace_dir else 'OFF'}")
     
     def load_config(self, config_file):
         """Load configuration from JSON file"""
@@ -47,146 +2084,558 @@ class MalaysianBankReceiptProcessor:
             print(f"⚠️  Error loading config: {e}. Using defaults.")
             return self.get_default_config()
     
-    def get_default_config(self):
-        """Return default configuration"""
-        return {
-            "name_keywords": [
-                "receive from", "sender", "from", "customer", "name"
-            ],
-            "banks": {},
-            "excluded_words": ["details", "transaction", "payment"],
-            "settings": {
-                "min_name_length": 3,
-                "max_name_words": 5,
-                "parallel_workers": 3,
-                "debug_mode": False
-            }
-        }
+    def config_fingerprint(self):
+        """Hash of the configuration sections that affect name extraction"""
+        extraction_settings = {
+            key: self.settings.get(key)
+            for key in ('min_name_length', 'max_name_words', 'bank_min_margin', 'method2')
+        }
+        if self.settings.get('method2') == 'scorer':
+            model_path = self.settings.get('name_scorer_model', 'name_scorer_model.json')
+            extraction_settings['name_scorer_model'] = [
+                model_path, os.path.getmtime(model_path) if os.path.exists(model_path) else None
+            ]
+        
+        relevant = {
+            'name_keywords': self.name_keywords,
+            'banks': self.banks,
+            'excluded_words': self.excluded_words,
+            'name_rules': self.config.get('name_rules', []),
+            'settings': extraction_settings
+        }
+        return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    
+    def get_default_config(self):
+        """Return default configuration"""
+        return {
+            "name_keywords": [
+                "receive from", "sender", "from", "customer", "name"
+            ],
+            "banks": {},
+            "excluded_words": ["details", "transaction", "payment"],
+            "settings": {
+                "min_name_length": 3,
+                "max_name_words": 5,
+                "bank_min_margin": 0.5,
+                "parallel_workers": 3,
+                "submit_window": 0,
+                "ocr_cache": True,
+                "ocr_cache_dir": ".ocr_cache",
+                "ocr_cache_max_mb": 200,
+                "text_store_max_mb": 64,
+                "async_max_in_flight": 64,
+                "execution_mode": "threads",
+                "pipeline_read_workers": 2,
+                "pipeline_extract_workers": 1,
+                "pipeline_rename_workers": 1,
+                "pipeline_queue_size": 16,
+                "textract_tps_initial": 5,
+                "textract_tps_min": 0.5,
+                "textract_tps_max": 25,
+                "textract_tps_increase": 0.5,
+                "textract_throttle_retries": 10,
+                "textract_error_retries": 3,
+                "textract_pool_connections": 0,
+                "textract_tcp_keepalive": True,
+                "textract_connect_timeout": 10,
+                "textract_read_timeout": 60,
+                "textract_retry_mode": "standard",
+                "textract_max_attempts": 1,
+                "preprocess_images": True,
+                "preprocess_max_edge": 2000,
+                "preprocess_jpeg_quality": 80,
+                "ocr_backend": "textract",
+                "pdf_text_layer": True,
+                "pdf_text_layer_min_chars": 20,
+                "tesseract_cmd": "tesseract",
+                "tesseract_lang": "eng",
+                "tesseract_batch_size": 16,
+                "tesseract_batch_wait_ms": 50,
+                "tesseract_workers": 2,
+                "analyzer": "fused",
+                "method2": "heuristic",
+                "name_scorer_model": "name_scorer_model.json",
+                "customer_index": True,
+                "customer_index_file": "customer_index.json",
+                "customer_index_max_distance": 2,
+                "extraction_memo": True,
+                "extraction_memo_file": ".extraction_memo.jsonl",
+                "scan_recursive": False,
+                "scan_sniff_magic": True,
+                "rename_journal": True,
+                "rename_journal_file": ".rename_journal.jsonl",
+                "checkpoint": True,
+                "checkpoint_file": ".receipt_checkpoint.jsonl",
+                "debug_mode": False,
+                "trace_dir": ".receipt_traces"
+            }
+        }
+    
+    def extract_document(self, image_path):
+        """Extract an OCRDocument from a file (empty if OCR fails)"""
+        try:
+            blocks, _ = self.extract_line_blocks(image_path)
+        except Exception:
+            blocks = []
+        return OCRDocument.from_blocks(blocks)
+    
+    def extract_line_blocks(self, image_path, trace=None):
+        """
+        Extract LINE blocks from a file, using a PDF text layer or the OCR
+        cache before calling the OCR backend
+        
+        Returns:
+            (blocks, source) where blocks are compact LINE dicts and source
+            is 'pdf_text_layer', 'cache' or the backend name
+        """
+        try:
+            image_bytes, cache_key, blocks, source = self._read_and_lookup(image_path, trace)
+            if blocks is not None:
+                return blocks, source
+            
+            blocks = self._detect_line_blocks(image_bytes)
+            self._store_line_blocks(cache_key, blocks)
+            
+            return blocks, self.ocr_backend_name
+        except Exception as e:
+            # Raised to the caller, which marks transient failures retryable
+            if trace is not None:
+                trace('ocr_error', error=str(e))
+            raise
+    
+    def _read_and_lookup(self, image_path, trace=None):
+        """
+        Read a file and try the cheap paths before OCR
+        
+        Returns:
+            (bytes, cache_key, blocks, source) where blocks is None when the
+            file still needs to go through the OCR backend
+        """
+        with open(image_path, 'rb') as document:
+            image_bytes = document.read()
+        
+        blocks = self._probe_pdf_text_layer(image_bytes, trace)
+        if blocks:
+            return image_bytes, None, blocks, 'pdf_text_layer'
+        
+        cache_key = None
+        if self.ocr_cache:
+            cache_key = self.ocr_cache.make_key(image_bytes, self.ocr_backend_name)
+            return image_bytes, cache_key, self.ocr_cache.get(cache_key), 'cache'
+        
+        return image_bytes, cache_key, None, None
+    
+    def _probe_pdf_text_layer(self, image_bytes, trace=None):
+        """Return the embedded text of a PDF, or None if it is image-only"""
+        if image_bytes[:4] != b'%PDF' or not self.settings.get('pdf_text_layer', True):
+            return None
+        if isinstance(self.ocr_backend, PyMuPDFTextBackend):
+            return None
+        
+        try:
+            blocks = self.pdf_text_backend.detect_lines(image_bytes)
+        except Exception as e:
+            if trace is not None:
+                trace('pdf_text_layer_error', error=str(e))
+            return None
+        
+        min_chars = self.settings.get('pdf_text_layer_min_chars', 20)
+        if sum(len(block['Text']) for block in blocks) < min_chars:
+            return None
+        return blocks
+    
+    def _store_line_blocks(self, cache_key, blocks):
+        """Save freshly extracted LINE blocks to the OCR cache"""
+        if cache_key and blocks:
+            self.ocr_cache.put(cache_key, blocks)
+    
+    def textract_client_options(self, concurrency):
+        """botocore client options from settings, with the connection pool sized to concurrency"""
+        pool_size = self.settings.get('textract_pool_connections') or max(10, concurrency)
+        return {
+            'max_pool_connections': pool_size,
+            'tcp_keepalive': self.settings.get('textract_tcp_keepalive', True),
+            'connect_timeout': self.settings.get('textract_connect_timeout', 10),
+            'read_timeout': self.settings.get('textract_read_timeout', 60),
+            # One attempt per call: TextractBackend retries throttling through the
+            # shared AdaptiveRateLimiter and other transient errors with backoff
+            'retries': {
+                'mode': self.settings.get('textract_retry_mode', 'standard'),
+                'max_attempts': self.settings.get('textract_max_attempts', 1)
+            }
+        }
+    
+    def create_textract_client(self, concurrency):
+        """Create the Textract client with a connection pool large enough for concurrency"""
+        options = self.textract_client_options(concurrency)
+        self.textract_pool_size = options['max_pool_connections']
+        
+        return boto3.client(
+            'textract',
+            region_name=self.region_name,
+            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            config=Config(**options)
+        )
+    
+    def ensure_textract_pool(self, concurrency):
+        """Recreate the shared client if the pool is smaller than the worker count"""
+        if concurrency <= self.textract_pool_size or self.settings.get('textract_pool_connections'):
+            return
+        
+        self.textract = self.create_textract_client(concurrency)
+        if isinstance(self.ocr_backend, TextractBackend):
+            self.ocr_backend.client = self.textract
+    
+    def create_ocr_backend(self, name):
+        """Create the OCR backend named in settings"""
+        if name == 'textract':
+            return TextractBackend(
+                self.textract,
+                self.rate_limiter,
+                throttle_retries=self.settings.get('textract_throttle_retries', 10),
+                error_retries=self.settings.get('textract_error_retries', 3),
+                preprocess=self.settings.get('preprocess_images', True),
+                max_edge=self.settings.get('preprocess_max_edge', 2000),
+                jpeg_quality=self.settings.get('preprocess_jpeg_quality', 80)
+            )
+        if name == 'tesseract':
+            return TesseractBackend(
+                tesseract_cmd=self.settings.get('tesseract_cmd', 'tesseract'),
+                lang=self.settings.get('tesseract_lang', 'eng'),
+                batch_size=self.settings.get('tesseract_batch_size', 16),
+                batch_wait=self.settings.get('tesseract_batch_wait_ms', 50) / 1000,
+                workers=self.settings.get('tesseract_workers', 2)
+            )
+        if name == 'pymupdf':
+            return PyMuPDFTextBackend()
+        raise ValueError(f"Unknown OCR backend: {name}")
+    
+    def _detect_line_blocks(self, image_bytes):
+        """Run the OCR backend on document bytes and return compact LINE blocks"""
+        return self.ocr_backend.detect_lines(image_bytes)
+    
+    def detect_bank(self, document):
+        """Detect which Malaysian bank this receipt is from"""
+        if not isinstance(document, OCRDocument):
+            document = OCRDocument.from_text(document)
+        return self._detect_bank_from_hits(self.keyword_matcher.find_all(document.full_text_lower),
+                                           document.full_text_lower)
+    
+    @staticmethod
+    def build_bank_index(banks):
+        """
+        Build the inverted index: indicator -> ((bank, weight), ...)
+        
+        An indicator shared by several banks (e.g. "from") is split between
+        them, so bank-specific indicators like "maybank2u" dominate the score.
+        """
+        owners = {}
+        for bank_name, bank_config in banks.items():
+            for indicator in bank_config.get('keywords', []) + bank_config.get('app_names', []):
+                if indicator:
+                    banks_for_indicator = owners.setdefault(indicator.lower(), [])
+                    if bank_name not in banks_for_indicator:
+                        banks_for_indicator.append(bank_name)
+        
+        return {
+            indicator: tuple((bank_name, 1.0 / len(bank_names)) for bank_name in bank_names)
+            for indicator, bank_names in owners.items()
+        }
+    
+    def score_banks(self, keyword_hits, text_lower=None):
+        """
+        Score every bank from the keywords found in a receipt, best first
+        
+        Each matched span scores once, for its longest indicator: "originator
+        name" doesn't also count "originator", nor "mae by maybank2u" also
+        count "maybank2u". When hits include such nested indicators, text_lower
+        is rescanned so a standalone "maybank2u" elsewhere still counts;
+        without it, nested indicators are dropped for the whole receipt.
+        """
+        indicators = [keyword for keyword in keyword_hits if keyword in self.bank_index]
+        nested = set().union(*(self._bank_nested[keyword] for keyword in indicators))
+        if nested and text_lower is not None:
+            nested -= self.bank_matcher.find_outermost(text_lower)
+        scores = {}
+        for keyword in indicators:
+            if keyword in nested:
+                continue
+            for bank_name, weight in self.bank_index[keyword]:
+                scores[bank_name] = scores.get(bank_name, 0.0) + weight
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    
+    def _detect_bank_from_hits(self, keyword_hits, text_lower=None, trace=None):
+        """Pick the best-scoring bank if it leads the runner-up by the configured margin"""
+        ranked = self.score_banks(keyword_hits, text_lower)
+        
+        if ranked:
+            best_bank, best_score = ranked[0]
+            margin = best_score - (ranked[1][1] if len(ranked) > 1 else 0.0)
+            
+            if margin >= self.settings.get('bank_min_margin', 0.5):
+                if trace is not None:
+                    trace('bank_detected', bank=best_bank, score=best_score, margin=margin)
+                return best_bank
+            
+            if trace is not None:
+                trace('bank_ambiguous', ranked=ranked[:3])
+        elif trace is not None:
+            trace('bank_not_identified')
+        return None
+    
+    def _has_excluded_word(self, text_lower):
+        """Check a lowercased text against excluded_words"""
+        return not self._excluded_set.isdisjoint(self.keyword_matcher.find_all(text_lower))
+    
+    def validate_name(self, candidate):
+        """
+        Clean and validate a candidate name
+        
+        Returns:
+            (clean_name, None) if valid, otherwise (None, reason)
+        """
+        # Check if it looks like a name (only letters and spaces)
+        if not candidate or not candidate.replace(' ', '').replace('.', '').isalpha():
+            return None, 'not alphabetic'
+        
+        clean_name = re.sub(r'\s+', ' ', candidate)
+        clean_name = re.sub(r'[^A-Za-z\s]', '', clean_name).strip()
+        
+        # Check length and word count
+        if len(clean_name) <= self.settings.get('min_name_length', 3):
+            return None, 'invalid length or word count'
+        if len(clean_name.split()) > self.settings.get('max_name_words', 5):
+            return None, 'invalid length or word count'
+        
+        # Check against excluded words
+        if self._has_excluded_word(clean_name.lower()):
+            return None, 'contains excluded words'
+        return clean_name, None
+    
+    def extract_customer_name(self, document):
+        """Extract customer name from Malaysian bank receipts - FIXED VERSION
+        
+        Takes an OCRDocument (a plain list of lines is still accepted).
+        """
+        customer_name, _ = self.extract_customer_name_with_path(document)
+        return customer_name
+    
+    def extract_customer_name_with_path(self, document, trace=None):
+        """
+        Extract the customer name and report which path found it
+        
+        Names close to a known customer are snapped to that customer's
+        spelling, so OCR noise doesn't produce a new filename.
+        
+        Returns:
+            (customer_name, path) where path is 'bank_extractor', 'method1',
+            'method2', or None when no name was found
+        """
+        if not isinstance(document, OCRDocument):
+            document = OCRDocument(list(document))
+        
+        memo_key = self.extraction_memo.make_key(document) if self.extraction_memo is not None else None
+        memoized = self.extraction_memo.get(memo_key) if memo_key else None
+        
+        if memoized is not None:
+            customer_name, path, rejected = memoized
+            if trace is not None:
+                trace('memo_hit', customer_name=customer_name, path=path)
+            if customer_name:
+                print(f"  ✓ Found customer name: {customer_name} (memoized)")
+            else:
+                print("  ✗ No customer name found (memoized)")
+        else:
+            customer_name, path, rejected = self._extract_name_candidate(document, trace)
+            if memo_key:
+                self.extraction_memo.put(memo_key, customer_name, path, rejected)
+        
+        # Label values that failed validation still win if they are a known customer
+        for candidate, candidate_path in rejected:
+            known_name = self.known_customer(candidate, fuzzy=True)
+            if known_name:
+                if trace is not None:
+                    trace('known_customer', candidate=candidate, customer_name=known_name)
+                print(f"  👤 Matched known customer: {known_name}")
+                return known_name, candidate_path
+        
+        known_name = self.known_customer(customer_name)
+        if known_name and known_name != customer_name:
+            if trace is not None:
+                trace('known_customer', candidate=customer_name, customer_name=known_name)
+            print(f"  👤 Matched known customer: {known_name}")
+            customer_name = known_name
+        return customer_name, path
+    
+    def known_customer(self, candidate, fuzzy=False):
+        """Known customer matching a candidate, or None (fuzzy for candidates that failed validation)"""
+        if self.customer_index is None or not candidate:
+            return None
+        return self.customer_index.lookup(candidate, fuzzy)
     
-    def extract_text_from_image(self, image_path):
-        """Extract text from image using AWS Textract"""
-        try:
-            with open(image_path, 'rb') as document:
-                image_bytes = document.read()
-            
-            response = self.textract.detect_document_text(
-                Document={'Bytes': image_bytes}
-            )
-            
-            # Extract all text lines
-            text_lines = []
-            for block in response['Blocks']:
-                if block['BlockType'] == 'LINE':
-                    text_lines.append(block['Text'])
-            
-            return text_lines, '\n'.join(text_lines)
-        except Exception as e:
-            if self.settings.get('debug_mode'):
-                print(f"  ✗ Error extracting text: {e}")
-            return [], ""
+    def _extract_name_candidate(self, document, trace=None):
+        """
+        Run bank extractor, Method 1 and Method 2 over a document
+        
+        Depends only on the document and configuration, so results can be memoized.
+        
+        Returns:
+            (customer_name, path, rejected) where rejected lists the
+            (candidate, path) label values that failed validation first
+        """
+        if self.settings.get('analyzer', 'fused') == 'sequential':
+            return self._extract_name_sequential(document, trace)
+        return self._extract_name_fused(document, trace)
     
-    def detect_bank(self, full_text):
-        """Detect which Malaysian bank this receipt is from"""
-        text_lower = full_text.lower()
+    def _extract_name_fused(self, document, trace=None):
+        """
+        Single-pass analyzer with the same results as _extract_name_sequential
         
-        for bank_name, bank_config in self.banks.items():
-            # Check if any bank-specific keywords are present
-            bank_keywords = bank_config.get('keywords', [])
-            app_names = bank_config.get('app_names', [])
+        One walk over the lines classifies each line, collects bank evidence,
+        tries every label rule (all bank layouts and Method 1) on it, and
+        remembers the first Method 2 fallback line. The result is then picked
+        by priority: detected bank layout, Method 1, Method 2.
+        """
+        text_lines = document.lines
+        max_words = self.settings.get('max_name_words', 5)
+        top_limit = max(10, len(text_lines) // 3)
+        
+        # Label rules in priority order; bank layouts only count for the detected bank
+        rules = [(bank_name, rule) for bank_name, rule in self.bank_extractors.items()]
+        rules += [(None, rule) for rule in self.name_rules]
+        matches = [None] * len(rules)
+        rule_rejected = [[] for _ in rules]
+        
+        def make_observer(k, path):
+            def observe(rule_name, anchor, line, how, candidate, reason):
+                if candidate and reason:
+                    rule_rejected[k].append((candidate, path))
+                if trace is not None:
+                    trace('candidate', rule=rule_name, anchor=anchor, line=line, how=how,
+                          text=text_lines[line], rejected=reason)
+            return observe
+        
+        # Keyword-anchored rules are only tried on lines where the matcher found an anchor
+        pending = [
+            (k, rule, make_observer(k, 'bank_extractor' if bank_name else 'method1'),
+             frozenset(anchor.lower() for anchor in rule.anchors) or None)
+            for k, (bank_name, rule) in enumerate(rules)
+        ]
+        all_anchors = frozenset().union(*(entry[3] for entry in pending if entry[3] is not None))
+        every_line = any(entry[3] is None for entry in pending)
+        
+        # Keyword classification of every line comes from one regex scan
+        line_hits = self.keyword_matcher.find_lines(document.lower_lines)
+        keyword_hits = set()
+        fallback = None
+        
+        for i, hits in enumerate(line_hits):
+            if hits:
+                keyword_hits |= hits
             
-            all_indicators = bank_keywords + app_names
+            if pending and (every_line or not all_anchors.isdisjoint(hits)):
+                for entry in list(pending):
+                    k, rule, observe, anchors = entry
+                    if anchors is not None and anchors.isdisjoint(hits):
+                        continue
+                    match = rule.match_at(document, i, line_hits, observe)
+                    if match is not None:
+                        matches[k] = match
+                        pending.remove(entry)
             
-            for indicator in all_indicators:
-                if indicator.lower() in text_lower:
-                    if self.settings.get('debug_mode'):
-                        print(f"  🏦 Detected bank: {bank_name}")
-                    return bank_name
+            if fallback is None and i < top_limit and self._is_fallback_name(text_lines[i], hits, max_words):
+                fallback = i
         
-        if self.settings.get('debug_mode'):
-            print(f"  🏦 Bank not identified")
-        return None
+        detected_bank = self._detect_bank_from_hits(keyword_hits, document.full_text_lower, trace)
+        
+        rejected = []
+        for k, (bank_name, rule) in enumerate(rules):
+            if bank_name is not None and bank_name != detected_bank:
+                continue
+            rejected.extend(rule_rejected[k])
+            if matches[k] is not None:
+                if bank_name is not None:
+                    print(f"  ✓ Found customer name: {matches[k].value} ({detected_bank} layout)")
+                    return matches[k].value, 'bank_extractor', rejected
+                print(f"  ✓ Found customer name: {matches[k].value}")
+                return matches[k].value, 'method1', rejected
+            if bank_name is not None and trace is not None:
+                trace('bank_layout_miss', bank=detected_bank)
+        
+        # Method 2: scorer over the whole receipt, or the first fallback line
+        if trace is not None:
+            trace('method2', strategy='scorer' if self.name_scorer is not None else 'heuristic')
+        
+        if self.name_scorer is not None:
+            clean_name = self.score_name_candidate(document, line_hits, trace)
+        else:
+            clean_name = text_lines[fallback] if fallback is not None else None
+            if clean_name and trace is not None:
+                trace('candidate', line=fallback, how='top', text=clean_name, rejected=None)
+        
+        if clean_name:
+            print(f"  ✓ Found customer name: {clean_name}")
+            return clean_name, 'method2', rejected
+        
+        print("  ✗ No customer name found")
+        return None, None, rejected
+    
+    def _is_fallback_name(self, line, hits, max_words):
+        """Method 2 heuristic: an alphabetic line of 2 to max_words words without excluded words"""
+        if len(line) < 6 or not line.replace(' ', '').isalpha():
+            return False
+        return 2 <= len(line.split()) <= max_words and self._excluded_set.isdisjoint(hits)
     
-    def extract_customer_name(self, text_lines, full_text):
-        """Extract customer name from Malaysian bank receipts - FIXED VERSION"""
+    def _extract_name_sequential(self, document, trace=None):
+        """Bank layout, then Method 1, then Method 2, each as its own scan"""
+        text_lines = document.lines
+        rejected = []
+        
+        # Classify every line once against all keyword lists
+        line_hits = [self.keyword_matcher.find_all(line) for line in document.lower_lines]
         
-        # Detect bank first (optional, for better accuracy)
-        detected_bank = self.detect_bank(full_text)
+        # Detect bank first; known layouts take the direct lookup path
+        detected_bank = self._detect_bank_from_hits(set().union(*line_hits), document.full_text_lower, trace)
+        
+        def observe(rule_name, anchor, line, how, candidate, reason):
+            if candidate and reason:
+                rejected.append((candidate, path))
+            if trace is not None:
+                trace('candidate', rule=rule_name, anchor=anchor, line=line, how=how,
+                      text=text_lines[line], rejected=reason)
+        
+        extractor = self.bank_extractors.get(detected_bank)
+        if extractor is not None:
+            path = 'bank_extractor'
+            match = extractor.run(document, line_hits, observe)
+            if match is not None:
+                print(f"  ✓ Found customer name: {match.value} ({detected_bank} layout)")
+                return match.value, 'bank_extractor', rejected
+            if trace is not None:
+                trace('bank_layout_miss', bank=detected_bank)
         
         # Get settings
-        min_length = self.settings.get('min_name_length', 3)
         max_words = self.settings.get('max_name_words', 5)
         
-        if self.settings.get('debug_mode'):
-            print(f"\n  🔍 Starting name extraction...")
-            print(f"  📋 Total lines: {len(text_lines)}")
-            print(f"  📏 Min length: {min_length}, Max words: {max_words}\n")
-        
-        # Method 1: Line-by-line search (MOST RELIABLE)
-        for i, line in enumerate(text_lines):
-            line_lower = line.lower()
-            
-            # Check if line contains any configured keyword
-            matched_keyword = None
-            for keyword in self.name_keywords:
-                if keyword in line_lower:
-                    matched_keyword = keyword
-                    break
-            
-            if matched_keyword:
-                if self.settings.get('debug_mode'):
-                    print(f"  📍 Line {i}: Found keyword '{matched_keyword}'")
-                    print(f"     Current line: '{line}'")
-                
-                # Next line is the name (SINGLE LINE ONLY!)
-                if i + 1 < len(text_lines):
-                    potential_name = text_lines[i + 1].strip()
-                    
-                    if self.settings.get('debug_mode'):
-                        print(f"     Next line: '{potential_name}'")
-                    
-                    # Check if it looks like a name (only letters and spaces)
-                    is_alpha = potential_name.replace(' ', '').replace('.', '').isalpha()
-                    
-                    if self.settings.get('debug_mode'):
-                        print(f"     Is alphabetic: {is_alpha}")
-                    
-                    if potential_name and is_alpha:
-                        # Clean the name
-                        clean_name = re.sub(r'\s+', ' ', potential_name)
-                        clean_name = re.sub(r'[^A-Za-z\s]', '', clean_name).strip()
-                        
-                        # Validate length and word count
-                        words = clean_name.split()
-                        
-                        if self.settings.get('debug_mode'):
-                            print(f"     Cleaned name: '{clean_name}'")
-                            print(f"     Length: {len(clean_name)}, Words: {len(words)}")
-                        
-                        # Check length and word count
-                        if len(clean_name) > min_length and len(words) <= max_words:
-                            # Check against excluded words
-                            has_excluded = any(excluded.lower() in clean_name.lower() 
-                                             for excluded in self.excluded_words)
-                            
-                            if self.settings.get('debug_mode'):
-                                print(f"     Has excluded words: {has_excluded}")
-                            
-                            if not has_excluded:
-                                print(f"  ✓ Found customer name: {clean_name}")
-                                return clean_name
-                            else:
-                                if self.settings.get('debug_mode'):
-                                    print(f"     ✗ Rejected: contains excluded words\n")
-                        else:
-                            if self.settings.get('debug_mode'):
-                                print(f"     ✗ Rejected: invalid length or word count\n")
-                    else:
-                        if self.settings.get('debug_mode'):
-                            print(f"     ✗ Rejected: not alphabetic\n")
+        # Method 1: label rules - value right of, below, or on the next line (SINGLE LINE ONLY!)
+        path = 'method1'
+        match = first_match(self.name_rules, document, line_hits, observe)
+        if match is not None:
+            print(f"  ✓ Found customer name: {match.value}")
+            return match.value, 'method1', rejected
         
         # Method 2: Smart detection - look for names in top portion
-        if self.settings.get('debug_mode'):
-            print("  🔍 Method 1 failed. Trying smart detection...\n")
+        if trace is not None:
+            trace('method2', strategy='scorer' if self.name_scorer is not None else 'heuristic')
+        
+        if self.name_scorer is not None:
+            clean_name = self.score_name_candidate(document, line_hits, trace)
+            if clean_name:
+                print(f"  ✓ Found customer name: {clean_name}")
+                return clean_name, 'method2', rejected
+            print("  ✗ No customer name found")
+            return None, None, rejected
         
         top_lines = text_lines[:max(10, len(text_lines) // 3)]
         
@@ -201,26 +2650,52 @@ class MalaysianBankReceiptProcessor:
             if is_alpha:
                 words = line.split()
                 
-                if self.settings.get('debug_mode'):
-                    print(f"  📝 Line {i}: '{line}' ({len(words)} words)")
-                
                 # Check word count (names usually have 2-5 words)
                 if 2 <= len(words) <= max_words:
                     # Check against excluded words
-                    has_excluded = any(excluded.lower() in line.lower() 
-                                     for excluded in self.excluded_words)
+                    has_excluded = not self._excluded_set.isdisjoint(line_hits[i])
                     
-                    if self.settings.get('debug_mode'):
-                        print(f"     Has excluded words: {has_excluded}")
+                    if trace is not None:
+                        trace('candidate', line=i, how='top', text=line,
+                              rejected='contains excluded words' if has_excluded else None)
                     
                     if not has_excluded:
                         print(f"  ✓ Found customer name: {line}")
-                        return line
-                    else:
-                        if self.settings.get('debug_mode'):
-                            print(f"     ✗ Rejected: contains excluded words\n")
+                        return line, 'method2', rejected
         
         print("  ✗ No customer name found")
+        return None, None, rejected
+    
+    def scorer_inputs(self, document, line_hits=None):
+        """Per-line inputs for the name scorer: (lines, has_excluded, has_keyword, confidences)"""
+        if line_hits is None:
+            line_hits = [self.keyword_matcher.find_all(line) for line in document.lower_lines]
+        confidences = document.confidences if len(document.confidences) == len(document) else [100.0] * len(document)
+        return (
+            document.lines,
+            [not self._excluded_set.isdisjoint(hits) for hits in line_hits],
+            [not self._name_keyword_set.isdisjoint(hits) for hits in line_hits],
+            confidences
+        )
+    
+    def score_name_candidate(self, document, line_hits=None, trace=None):
+        """
+        Method 2 with the linear name scorer
+        
+        Scores one receipt: Method 2 only runs once the label rules have
+        missed, inside each receipt's extraction. Every line above the
+        scorer's threshold is tried, best first.
+        
+        Returns:
+            The best-scoring line that passes validate_name, or None
+        """
+        ranked = self.name_scorer.rank_lines([self.scorer_inputs(document, line_hits)])[0]
+        for j in ranked:
+            clean_name, reason = self.validate_name(document.lines[j].strip())
+            if trace is not None:
+                trace('candidate', line=j, how='scorer', text=document.lines[j], rejected=reason)
+            if clean_name:
+                return clean_name
         return None
     
     def rename_file(self, file_path, customer_name):
@@ -229,8 +2704,8 @@ class MalaysianBankReceiptProcessor:
             return False
         
         try:
-            directory = os.path.dirname(file_path)
-            extension = os.path.splitext(file_path)[1]
+            # Real type for files the scan recognized by their magic bytes
+            extension = receipt_extension(file_path) or os.path.splitext(file_path)[1]
             
             # Convert to proper filename format
             # "WONG CHUN TIM" -> "Wong_Chun_Tim"
@@ -239,19 +2714,11 @@ class MalaysianBankReceiptProcessor:
             # Remove any invalid characters
             safe_name = re.sub(r'[^\w\s-]', '', safe_name)
             
-            # Create new filename
-            new_filename = f"{safe_name}_receipt{extension}"
-            new_path = os.path.join(directory, new_filename)
-            
-            # Handle duplicate names
-            counter = 1
-            while os.path.exists(new_path):
-                new_filename = f"{safe_name}_receipt_{counter}{extension}"
-                new_path = os.path.join(directory, new_filename)
-                counter += 1
+            # Pick a free name and move the file without ever overwriting
+            new_filename = self.rename_planner.rename(
+                file_path, f"{safe_name}_receipt", extension, self.rename_journal
+            )
             
-            # Rename the file
-            os.rename(file_path, new_path)
             print(f"  ✓ Renamed to: {new_filename}")
             return new_filename
             
@@ -262,84 +2729,168 @@ class MalaysianBankReceiptProcessor:
     def process_single_file(self, file_path):
         """Process a single receipt file"""
         filename = os.path.basename(file_path)
-        
-        if self.settings.get('debug_mode'):
-            print(f"\n{'─'*60}")
-            print(f"Processing: {filename}")
-            print(f"{'─'*60}")
-        else:
-            print(f"\nProcessing: {filename}")
+        self._print_file_header(filename)
+        trace = self.start_trace(file_path)
         
         try:
             # Extract text
-            text_lines, full_text = self.extract_text_from_image(file_path)
-            
-            if not text_lines:
-                return {
-                    'original_file': filename,
-                    'status': 'error',
-                    'error': 'No text extracted',
-                    'timestamp': datetime.now().isoformat()
-                }
-            
-            print(f"  ✓ Extracted {len(text_lines)} lines")
-            
-            # Show extracted text in debug mode
-            if self.settings.get('debug_mode'):
-                print("\n  Extracted text (first 15 lines):")
-                for i, line in enumerate(text_lines[:15], 1):
-                    print(f"    {i:2d}. {line}")
-                if len(text_lines) > 15:
-                    print(f"    ... and {len(text_lines) - 15} more lines")
-            
-            # Extract customer name
-            customer_name = self.extract_customer_name(text_lines, full_text)
-            
-            if customer_name:
-                # Rename file
-                new_filename = self.rename_file(file_path, customer_name)
-                
-                if new_filename:
-                    return {
-                        'original_file': filename,
-                        'customer_name': customer_name,
-                        'new_filename': new_filename,
-                        'status': 'success',
-                        'timestamp': datetime.now().isoformat()
-                    }
-                else:
-                    return {
-                        'original_file': filename,
-                        'customer_name': customer_name,
-                        'status': 'rename_failed',
-                        'timestamp': datetime.now().isoformat()
-                    }
-            else:
-                return {
-                    'original_file': filename,
-                    'status': 'no_name_found',
-                    'timestamp': datetime.now().isoformat()
-                }
+            blocks, ocr_source = self.extract_line_blocks(file_path, trace)
+            result = self._process_line_blocks(file_path, blocks, ocr_source, trace)
         
         except Exception as e:
             print(f"  ✗ Error: {e}")
-            return {
+            result = {
                 'original_file': filename,
                 'status': 'error',
                 'error': str(e),
+                'retryable': is_transient_error(e),
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        self.finish_trace(trace, result)
+        return result
+    
+    def start_trace(self, file_path):
+        """Return a trace for a file, or None when tracing is off"""
+        if self.trace_dir is None:
+            return None
+        return ReceiptTrace(os.path.basename(file_path))
+    
+    def finish_trace(self, trace, result):
+        """Record the file's result and write its trace"""
+        if trace is None:
+            return
+        trace('result', status=result.get('status'), customer_name=result.get('customer_name'),
+              new_filename=result.get('new_filename'), error=result.get('error'))
+        trace.write(self.trace_dir)
+    
+    def _print_file_header(self, filename):
+        """Print the per-file processing header"""
+        print(f"\nProcessing: {filename}")
+    
+    def _process_line_blocks(self, file_path, blocks, ocr_source, trace=None):
+        """Extract the customer name from OCR output and rename the file"""
+        customer_name, extraction_path, result = self._analyze_line_blocks(file_path, blocks, ocr_source, trace)
+        if result is not None:
+            return result
+        return self._rename_and_report(file_path, customer_name, ocr_source, extraction_path)
+    
+    def _analyze_line_blocks(self, file_path, blocks, ocr_source, trace=None):
+        """
+        Extract the customer name from OCR output
+        
+        Returns:
+            (customer_name, extraction_path, None) when a name was found,
+            otherwise (None, None, result) with the finished result for the file
+        """
+        filename = os.path.basename(file_path)
+        
+        document = OCRDocument.from_blocks(blocks)
+        text_lines = document.lines
+        
+        if not text_lines:
+            return None, None, {
+                'original_file': filename,
+                'status': 'error',
+                'error': 'No text extracted',
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        if ocr_source == 'cache':
+            print(f"  ✓ Extracted {len(text_lines)} lines (cached)")
+        elif ocr_source == 'pdf_text_layer':
+            print(f"  ✓ Extracted {len(text_lines)} lines (PDF text layer)")
+        else:
+            print(f"  ✓ Extracted {len(text_lines)} lines")
+        
+        # Keep the extracted text in the trace
+        if trace is not None:
+            trace('text', source=ocr_source, lines=text_lines)
+        
+        # Extract customer name
+        customer_name, extraction_path = self.extract_customer_name_with_path(document, trace)
+        
+        if customer_name:
+            return customer_name, extraction_path, None
+        
+        # Keep the text so manual review doesn't call OCR again
+        if self.keep_text:
+            self.text_store.put(str(file_path), text_lines)
+        
+        return None, None, {
+            'original_file': filename,
+            'status': 'no_name_found',
+            'ocr_source': ocr_source,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def _rename_and_report(self, file_path, customer_name, ocr_source, extraction_path=None):
+        """Rename a file to the extracted customer name and build its result"""
+        filename = os.path.basename(file_path)
+        new_filename = self.rename_file(file_path, customer_name)
+        
+        if new_filename:
+            result = {
+                'original_file': filename,
+                'customer_name': customer_name,
+                'new_filename': new_filename,
+                'status': 'success',
+                'ocr_source': ocr_source,
+                'extraction_path': extraction_path,
                 'timestamp': datetime.now().isoformat()
             }
+            if self.customer_index is not None and CustomerIndex.is_learnable(result):
+                self.customer_index.add(customer_name)
+            return result
+        else:
+            return {
+                'original_file': filename,
+                'customer_name': customer_name,
+                'status': 'rename_failed',
+                'ocr_source': ocr_source,
+                'extraction_path': extraction_path,
+                'timestamp': datetime.now().isoformat()
+            }
+    
+    def find_receipt_files(self, folder_path):
+        """Stream the receipt files in a folder, leaving out files this run renamed"""
+        for file_path in scan_receipt_files(
+            folder_path,
+            recursive=self.settings.get('scan_recursive', False),
+            sniff=self.settings.get('scan_sniff_magic', True)
+        ):
+            # A lazy scan can meet a file again under the name it was just given
+            if not self.rename_planner.is_reserved(file_path):
+                yield file_path
     
-    def process_folder(self, folder_path, max_workers=None):
+    def _open_scan(self, folder_path):
+        """Start streaming a folder's receipt files; None when there are none"""
+        files = self.find_receipt_files(folder_path)
+        first = next(files, None)
+        if first is None:
+            return None
+        return chain([first], files)
+    
+    def process_folder(self, folder_path, max_workers=None, resume=False, finish_report=True):
         """
         Process all receipt files in a folder
         
+        Successful results are streamed to the report as files finish; only
+        the rest are kept in memory.
+        
         Args:
             folder_path: Path to folder containing receipts
             max_workers: Number of parallel workers (default: from config)
+            resume: Skip files finished by an earlier, interrupted run
+            finish_report: Save the report and print the summary at the end
+                (False leaves that to the caller, e.g. after manual review)
+        
+        Returns:
+            Results that were not renamed automatically
         """
         if max_workers is None:
             max_workers = self.settings.get('parallel_workers', 3)
+        max_workers = self.ocr_concurrency(max_workers)
         
         print(f"\n{'='*60}")
         print(f"MALAYSIAN BANK RECEIPT PROCESSOR")
@@ -348,92 +2899,404 @@ class MalaysianBankReceiptProcessor:
         print(f"Workers: {max_workers}")
         print(f"{'='*60}\n")
         
-        # Find all image files - FIXED: Prevent duplicates
-        folder = Path(folder_path)
-        supported_formats = ['.jpg', '.jpeg', '.png', '.pdf', '.JPG', '.JPEG', '.PNG', '.PDF']
-        
-        files = []
-        seen_files = set()  # Track unique files by lowercase name
-        
-        for ext in supported_formats:
-            for file_path in folder.glob(f'*{ext}'):
-                # Use lowercase filename to avoid case-sensitive duplicates
-                file_key = file_path.name.lower()
-                
-                if file_key not in seen_files:
-                    files.append(file_path)
-                    seen_files.add(file_key)
-                else:
-                    if self.settings.get('debug_mode'):
-                        print(f"⚠️  Skipping duplicate: {file_path.name}")
+        self._reset_run_state()
+        files = self._open_scan(folder_path)
         
-        if not files:
+        if files is None:
             print("⚠️  No receipt files found in folder!")
             return []
         
-        print(f"Found {len(files)} unique receipt file(s) to process\n")
+        # Process files as the scan finds them
+        self.seed_customer_index(folder_path)
+        recovered = self.start_rename_journal(folder_path)
+        self.start_checkpoint(folder_path, resume, recovered)
+        self.start_report(folder_path)
+        files = self._skip_finished(files, resume)
+        self.ensure_textract_pool(max_workers)
         
-        # Process files
-        self.results = []
+        try:
+            self._process_files(files, max_workers)
+        except BaseException:
+            # Interrupted: still leave a valid report of the files that finished
+            self.save_report(folder_path)
+            raise
+        finally:
+            self.ocr_backend.close()
+        
+        # Generate and save report
+        if finish_report:
+            self.save_report(folder_path)
+        
+        return self.results
+    
+    def ocr_concurrency(self, workers):
+        """
+        Number of files to OCR at once
         
-        if max_workers == 1:
+        Tesseract batches only the images waiting at the same moment, so
+        parallel runs use at least tesseract_batch_size workers with it.
+        """
+        if workers > 1 and isinstance(self.ocr_backend, TesseractBackend):
+            return max(workers, self.ocr_backend.batch_size)
+        return workers
+    
+    def _process_files(self, files, max_workers):
+        """Run files through the configured execution mode, recording each result"""
+        if self.settings.get('execution_mode') == 'pipeline':
+            # Staged pipeline; max_workers sizes the OCR stage
+            pipeline = ReceiptPipeline(
+                self,
+                read_workers=self.settings.get('pipeline_read_workers', 2),
+                ocr_workers=max_workers,
+                extract_workers=self.settings.get('pipeline_extract_workers', 1),
+                rename_workers=self.settings.get('pipeline_rename_workers', 1),
+                queue_size=self.settings.get('pipeline_queue_size', 16)
+            )
+            for i, file_path, result in pipeline.run(files):
+                print(f"\n[{i}]")
+                self._record_result(file_path, result)
+        elif max_workers == 1:
             # Sequential processing
             for i, file_path in enumerate(files, 1):
-                print(f"\n[{i}/{len(files)}]")
-                result = self.process_single_file(str(file_path))
-                self.results.append(result)
+                print(f"\n[{i}]")
+                result = self.process_single_file(file_path)
+                self._record_result(file_path, result)
         else:
-            # Parallel processing
+            # Parallel processing with at most `window` files submitted at once,
+            # so memory stays flat however many files the scan yields
+            window = self.settings.get('submit_window', 0) or max_workers * 4
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                future_to_file = {
-                    executor.submit(self.process_single_file, str(f)): (i, f)
-                    for i, f in enumerate(files, 1)
-                }
+                in_flight = {}
+                for i, file_path in enumerate(files, 1):
+                    if len(in_flight) >= window:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        self._collect_futures(done, in_flight)
+                    in_flight[executor.submit(self.process_single_file, file_path)] = (i, file_path)
                 
-                for future in as_completed(future_to_file):
-                    i, file_path = future_to_file[future]
-                    print(f"\n[{i}/{len(files)}]")
-                    try:
-                        result = future.result()
-                        self.results.append(result)
-                    except Exception as e:
-                        print(f"  ✗ Unexpected error: {e}")
-                        self.results.append({
-                            'original_file': file_path.name,
-                            'status': 'error',
-                            'error': str(e),
-                            'timestamp': datetime.now().isoformat()
-                        })
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._collect_futures(done, in_flight)
+    
+    def _collect_futures(self, done, in_flight):
+        """Record the results of finished futures and drop them from in_flight"""
+        for future in done:
+            i, file_path = in_flight.pop(future)
+            print(f"\n[{i}]")
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"  ✗ Unexpected error: {e}")
+                result = {
+                    'original_file': os.path.basename(file_path),
+                    'status': 'error',
+                    'error': str(e),
+                    'retryable': is_transient_error(e),
+                    'timestamp': datetime.now().isoformat()
+                }
+            self._record_result(file_path, result)
+    
+    async def aprocess_folder(self, folder_path, max_in_flight=None, resume=False):
+        """
+        Process all receipt files in a folder on an asyncio event loop
+        
+        Textract requests overlap on a single thread instead of one OS thread
+        per worker. Uses aiobotocore (see requirements.txt) for Textract; the
+        local OCR backends run in a thread pool sized to max_in_flight. File
+        reads, extraction, renames and checkpointing run in worker threads so
+        they never block the event loop.
+        
+        Args:
+            folder_path: Path to folder containing receipts
+            max_in_flight: Maximum concurrent Textract requests (default: from config)
+            resume: Skip files finished by an earlier, interrupted run
+        """
+        if max_in_flight is None:
+            max_in_flight = self.settings.get('async_max_in_flight', 64)
+        max_in_flight = self.ocr_concurrency(max_in_flight)
+        
+        print(f"\n{'='*60}")
+        print(f"MALAYSIAN BANK RECEIPT PROCESSOR (ASYNC)")
+        print(f"{'='*60}")
+        print(f"Folder: {folder_path}")
+        print(f"Max in-flight requests: {max_in_flight}")
+        print(f"{'='*60}\n")
+        
+        self._reset_run_state()
+        files = self._open_scan(folder_path)
+        
+        if files is None:
+            print("⚠️  No receipt files found in folder!")
+            return []
+        
+        self.seed_customer_index(folder_path)
+        recovered = self.start_rename_journal(folder_path)
+        self.start_checkpoint(folder_path, resume, recovered)
+        self.start_report(folder_path)
+        files = self._skip_finished(files, resume)
+        self.ensure_textract_pool(max_in_flight)
+        
+        try:
+            await self._aprocess_files(files, max_in_flight)
+        except BaseException:
+            # Interrupted or cancelled: still leave a valid report of the files that finished
+            self.save_report(folder_path)
+            raise
+        finally:
+            self.ocr_backend.close()
         
         # Generate and save report
         self.save_report(folder_path)
         
         return self.results
     
-    def save_report(self, folder_path):
-        """Save processing report"""
+    async def _aprocess_files(self, files, max_in_flight):
+        """Run files through the async OCR path with at most max_in_flight requests"""
+        async with AsyncExitStack() as stack:
+            if isinstance(self.ocr_backend, TextractBackend) and get_aio_session is not None:
+                session = get_aio_session()
+                self.ocr_backend.aio_client = await stack.enter_async_context(session.create_client(
+                    'textract',
+                    region_name=self.region_name,
+                    aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                    aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                    config=AioConfig(**self.textract_client_options(max_in_flight))
+                ))
+                stack.callback(setattr, self.ocr_backend, 'aio_client', None)
+            else:
+                if isinstance(self.ocr_backend, TextractBackend):
+                    raise RuntimeError("aprocess_folder needs aiobotocore for Textract: pip install -r requirements.txt")
+                self._aio_executor = ThreadPoolExecutor(max_workers=max_in_flight)
+                stack.callback(setattr, self, '_aio_executor', None)
+                stack.callback(self._aio_executor.shutdown)
+            
+            # Results are recorded one at a time, off the loop (report writes, checkpoint fsyncs)
+            record_executor = ThreadPoolExecutor(max_workers=1)
+            stack.callback(record_executor.shutdown)
+            loop = asyncio.get_running_loop()
+            semaphore = asyncio.Semaphore(max_in_flight)
+            tasks = set()
+            
+            def record(i, file_path, result):
+                print(f"\n[{i}]")
+                self._record_result(file_path, result)
+            
+            async def run(i, file_path):
+                try:
+                    result = await self.aprocess_single_file(file_path)
+                    await loop.run_in_executor(record_executor, record, i, file_path, result)
+                finally:
+                    semaphore.release()
+            
+            # Each task holds a permit, bounding in-flight Textract requests
+            for i, file_path in enumerate(files, 1):
+                await semaphore.acquire()
+                task = asyncio.create_task(run(i, file_path))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            
+            if tasks:
+                await asyncio.gather(*tasks)
+    
+    async def aprocess_single_file(self, file_path):
+        """Process a single receipt file, awaiting the OCR request"""
+        filename = os.path.basename(file_path)
+        self._print_file_header(filename)
+        trace = self.start_trace(file_path)
+        
+        try:
+            image_bytes, cache_key, blocks, ocr_source = await asyncio.to_thread(
+                self._read_and_lookup, file_path, trace)
+            if blocks is None:
+                blocks = await self._adetect_line_blocks(image_bytes)
+                await asyncio.to_thread(self._store_line_blocks, cache_key, blocks)
+                ocr_source = self.ocr_backend_name
+        except Exception as e:
+            if trace is not None:
+                trace('ocr_error', error=str(e))
+            print(f"  ✗ Error: {e}")
+            result = {
+                'original_file': filename,
+                'status': 'error',
+                'error': str(e),
+                'retryable': is_transient_error(e),
+                'timestamp': datetime.now().isoformat()
+            }
+            self.finish_trace(trace, result)
+            return result
+        
+        try:
+            result = await asyncio.to_thread(self._process_line_blocks, file_path, blocks, ocr_source, trace)
+        except Exception as e:
+            print(f"  ✗ Error: {e}")
+            result = {
+                'original_file': filename,
+                'status': 'error',
+                'error': str(e),
+                'retryable': is_transient_error(e),
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        self.finish_trace(trace, result)
+        return result
+    
+    async def _adetect_line_blocks(self, image_bytes):
+        """Async counterpart of _detect_line_blocks"""
+        return await self.ocr_backend.adetect_lines(image_bytes, self._aio_executor)
+    
+    def _reset_run_state(self):
+        """Clear per-run results, stored text and cache counters"""
+        self.results = []
+        self.skipped_files = 0
+        self.renamed_count = 0
+        self.text_store.clear()
+        self.rename_planner.reset()
+        if self.ocr_cache:
+            self.ocr_cache.reset_stats()
+        if self.extraction_memo is not None:
+            self.extraction_memo.reset_stats()
+    
+    def seed_customer_index(self, folder_path):
+        """Import known customers from past reports and results files"""
+        if self.customer_index is None:
+            return
+        
+        sources = sorted(Path(folder_path).glob('receipt_processing_report_*.json'))
+        sources += [Path(folder_path) / 'receipt_results.csv', Path('receipt_results.csv')]
+        imported = self.customer_index.seed([str(p) for p in sources if p.exists()])
+        if imported:
+            print(f"👤 Imported {imported} names ({len(self.customer_index)} known customers)")
+    
+    def start_rename_journal(self, folder_path):
+        """
+        Open the folder's rename journal, settling renames left by an interrupted run
+        
+        Returns:
+            List of (src, dst) renames recovered from the journal
+        """
+        if not self.settings.get('rename_journal', True):
+            return []
+        if self.rename_journal is not None:
+            self.rename_journal.close()
+        
+        self.rename_journal = RenameJournal(
+            os.path.join(folder_path, self.settings.get('rename_journal_file', '.rename_journal.jsonl'))
+        )
+        recovered = self.rename_journal.recover()
+        if recovered:
+            print(f"📒 Recovered {len(recovered)} rename(s) from an interrupted run:")
+            for src, dst in recovered:
+                print(f"  {src} → {dst}")
+            print()
+        return recovered
+    
+    def start_checkpoint(self, folder_path, resume=False, recovered=()):
+        """Open the folder's checkpoint, continuing it when resuming"""
+        if not self.settings.get('checkpoint', True):
+            return
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+        
+        self.checkpoint = ProcessingCheckpoint(
+            os.path.join(folder_path, self.settings.get('checkpoint_file', '.receipt_checkpoint.jsonl')),
+            resume
+        )
+        # Renames finished just before a crash never reached the checkpoint
+        for src, dst in recovered:
+            self.checkpoint.record(
+                os.path.join(folder_path, src),
+                {'status': 'success', 'original_file': os.path.basename(src), 'new_filename': os.path.basename(dst)}
+            )
+    
+    def _skip_finished(self, files, resume):
+        """Lazily drop files the checkpoint already has a final outcome for"""
+        if not resume or self.checkpoint is None:
+            return files
+        
+        print(f"⏭️  Resuming: skipping files finished by an earlier run\n")
+        
+        def remaining():
+            for file_path in files:
+                if self.checkpoint.is_done(file_path):
+                    self.skipped_files += 1
+                else:
+                    yield file_path
+        
+        return remaining()
+    
+    def start_report(self, folder_path):
+        """Open this run's report, which results stream into"""
         report_filename = f"receipt_processing_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        report_path = os.path.join(folder_path, report_filename)
+        self.report = StreamingReport(os.path.join(folder_path, report_filename))
+    
+    def _record_result(self, file_path, result):
+        """Stream a finished file's result to the report and checkpoint it
+        
+        Only results that may still need attention stay in self.results.
+        """
+        result['original_path'] = str(file_path)
+        if result['status'] == 'success':
+            self.report.add_success(result)
+        else:
+            self.results.append(result)
+        if self.checkpoint is not None:
+            self.checkpoint.record(str(file_path), result)
+    
+    def save_report(self, folder_path):
+        """Finish the streamed report and print the run summary"""
+        report = self.report
+        if report is None:
+            return
+        report.close(self.results)
+        self.report = None
+        report_path = report.report_path
+        report_filename = os.path.basename(report_path)
         
-        with open(report_path, 'w', encoding='utf-8') as f:
-            json.dump(self.results, f, indent=2, ensure_ascii=False)
+        if self.customer_index is not None:
+            self.customer_index.mark_imported(report_path)
+            self.customer_index.save()
+        if self.extraction_memo is not None:
+            self.extraction_memo.save()
+        if self.rename_journal is not None:
+            self.rename_journal.sync()
         
         # Print summary
         print(f"\n{'='*60}")
         print("PROCESSING SUMMARY")
         print(f"{'='*60}")
         
-        total = len(self.results)
-        success = sum(1 for r in self.results if r['status'] == 'success')
+        total = report.successes + len(self.results)
+        success = self.renamed_count = report.successes
+        manual = sum(1 for r in self.results if r['status'] == 'success_manual')
         no_name = sum(1 for r in self.results if r['status'] == 'no_name_found')
         errors = sum(1 for r in self.results if r['status'] == 'error')
         rename_failed = sum(1 for r in self.results if r['status'] == 'rename_failed')
         
         print(f"Total files processed: {total}")
         print(f"✓ Successfully renamed: {success} ({success/total*100:.1f}%)" if total > 0 else "✓ Successfully renamed: 0")
+        if manual:
+            print(f"✓ Renamed manually: {manual}")
         print(f"⚠ No name found: {no_name}")
         print(f"⚠ Rename failed: {rename_failed}")
         print(f"✗ Errors: {errors}")
+        if self.skipped_files:
+            print(f"⏭️  Skipped (finished in an earlier run): {self.skipped_files}")
+        
+        if self.ocr_cache:
+            print(f"🗄️  OCR cache: {self.ocr_cache.hits} hit(s), {self.ocr_cache.misses} miss(es)")
+        if self.extraction_memo is not None:
+            print(f"🧠 Extraction memo: {self.extraction_memo.hits} hit(s), {self.extraction_memo.misses} miss(es)")
+        
+        path_counts = report.path_counts
+        named = sum(path_counts.values())
+        if named > 0:
+            print("🧭 Name found by: " + ", ".join(
+                f"{path} {count} ({count/named*100:.1f}%)"
+                for path, count in sorted(path_counts.items(), key=lambda item: -item[1])
+            ))
+        
+        text_layer = report.text_layer
+        if text_layer > 0:
+            print(f"📄 PDF text layer used (no OCR): {text_layer}")
         
         print(f"\n📊 Detailed report saved to: {report_filename}")
         print(f"{'='*60}\n")
@@ -441,9 +3304,10 @@ class MalaysianBankReceiptProcessor:
         # Show successfully renamed files
         if success > 0:
             print("✓ Successfully renamed files:")
-            for r in self.results:
-                if r['status'] == 'success':
-                    print(f"  {r['original_file']} → {r['new_filename']}")
+            for original_file, new_filename in report.listed:
+                print(f"  {original_file} → {new_filename}")
+            if success > len(report.listed):
+                print(f"  ... and {success - len(report.listed)} more (see {report_filename})")
             print()
         
         # Show failed files details
@@ -466,16 +3330,30 @@ class MalaysianBankReceiptProcessor:
 class InteractiveMalaysianReceiptProcessor(MalaysianBankReceiptProcessor):
     """Extended processor with interactive mode for failed receipts"""
     
-    def process_folder_interactive(self, folder_path):
+    # Manual review shows the first-pass text of receipts without a name
+    keep_text = True
+    
+    def process_folder_interactive(self, folder_path, resume=False):
         """Process folder with interactive fallback for failed receipts"""
-        
-        # First pass: automatic processing
-        results = self.process_folder(folder_path)
+        try:
+            return self._process_and_review(folder_path, resume)
+        except BaseException:
+            # Interrupted during review: keep a valid report (no-op if already saved)
+            self.save_report(folder_path)
+            raise
+        finally:
+            self.text_store.clear()
+    
+    def _process_and_review(self, folder_path, resume):
+        """Automatic pass, then manual review of the receipts it couldn't name"""
+        # First pass: automatic processing (report finished after the review)
+        results = self.process_folder(folder_path, resume=resume, finish_report=False)
         
         # Find failed receipts
         failed = [r for r in results if r['status'] in ['no_name_found', 'error']]
         
         if not failed:
+            self.save_report(folder_path)
             print("\n✓ All receipts processed successfully!")
             return results
         
@@ -488,12 +3366,13 @@ class InteractiveMalaysianReceiptProcessor(MalaysianBankReceiptProcessor):
         
         if response not in ['yes', 'y']:
             print("Skipping manual review.")
+            self.save_report(folder_path)
             return results
         
         # Process failed receipts interactively
         for i, result in enumerate(failed, 1):
             original_file = result['original_file']
-            file_path = os.path.join(folder_path, original_file)
+            file_path = result.get('original_path', os.path.join(folder_path, original_file))
             
             # Check if file still exists
             if not os.path.exists(file_path):
@@ -504,8 +3383,8 @@ class InteractiveMalaysianReceiptProcessor(MalaysianBankReceiptProcessor):
             print(f"[{i}/{len(failed)}] {original_file}")
             print(f"{'─'*60}")
             
-            # Extract and show text
-            text_lines, full_text = self.extract_text_from_image(file_path)
+            # Show text kept from the first pass (no extra OCR calls)
+            text_lines = self.text_store.get(file_path)
             
             if text_lines:
                 print("Extracted text:")
@@ -529,11 +3408,15 @@ class InteractiveMalaysianReceiptProcessor(MalaysianBankReceiptProcessor):
                     result['customer_name'] = customer_name
                     result['new_filename'] = new_filename
                     result['status'] = 'success_manual'
+                    if self.customer_index is not None:
+                        self.customer_index.add(customer_name)
+                    if self.checkpoint is not None:
+                        self.checkpoint.record(file_path, result)
                     print(f"✓ Manually renamed to: {new_filename}")
             else:
                 print("⊘ Skipped")
         
-        # Save updated report
+        # Save the report with the manual renames
         self.save_report(folder_path)
         
         return self.results
@@ -554,14 +3437,47 @@ if __name__ == "__main__":
     # Number of parallel workers (1-5, lower = safer for AWS rate limits)
     MAX_WORKERS = 3
     
+    # Use the asyncio pipeline (automatic mode only; concurrency from
+    # "async_max_in_flight" in bank_config.json)
+    ASYNC_MODE = False
+    
     # ============================================
     # MAIN SCRIPT - DO NOT EDIT BELOW
     # ============================================
     
+    parser = argparse.ArgumentParser(description="Malaysian Bank Receipt Auto-Renamer")
+    parser.add_argument('folder', nargs='?', default=FOLDER_PATH, help="Receipt folder")
+    parser.add_argument('--undo', action='store_true', help="undo renames from the folder's rename journal")
+    parser.add_argument('--all', action='store_true', help="with --undo: revert every run, not just the last one")
+    parser.add_argument('--resume', action='store_true', help="skip files finished by an interrupted run")
+    args = parser.parse_args()
+    FOLDER_PATH = args.folder
+    
+    if args.all and not args.undo:
+        parser.error("--all only applies to --undo")
+    
+    if args.undo:
+        settings = {}
+        if os.path.exists('bank_config.json'):
+            with open('bank_config.json', 'r', encoding='utf-8') as f:
+                settings = json.load(f).get('settings', {})
+        journal_file = os.path.join(FOLDER_PATH, settings.get('rename_journal_file', '.rename_journal.jsonl'))
+        
+        if not os.path.exists(journal_file):
+            print(f"\n⚠️  No rename journal found in '{FOLDER_PATH}'")
+            exit(1)
+        
+        print(f"\n↩️  Undoing renames in {FOLDER_PATH}")
+        journal = RenameJournal(journal_file)
+        restored = journal.undo(all_runs=args.all)
+        journal.close()
+        print(f"\n✓ Restored {restored} file(s) to their original names")
+        exit(0)
+    
     print("\n🇲🇾 Malaysian Bank Receipt Auto-Renamer")
     print("=" * 60)
     print(f"Folder: {FOLDER_PATH}")
-    print(f"Mode: {'Interactive' if INTERACTIVE_MODE else 'Automatic'}")
+    print(f"Mode: {'Interactive' if INTERACTIVE_MODE else 'Automatic'}{' (async)' if ASYNC_MODE and not INTERACTIVE_MODE else ''}")
     print(f"Workers: {MAX_WORKERS}")
     print("=" * 60)
     
@@ -662,8 +3578,58 @@ if __name__ == "__main__":
             "settings": {
                 "min_name_length": 3,
                 "max_name_words": 5,
+                "bank_min_margin": 0.5,
                 "parallel_workers": 3,
-                "debug_mode": False
+                "submit_window": 0,
+                "ocr_cache": True,
+                "ocr_cache_dir": ".ocr_cache",
+                "ocr_cache_max_mb": 200,
+                "text_store_max_mb": 64,
+                "async_max_in_flight": 64,
+                "execution_mode": "threads",
+                "pipeline_read_workers": 2,
+                "pipeline_extract_workers": 1,
+                "pipeline_rename_workers": 1,
+                "pipeline_queue_size": 16,
+                "textract_tps_initial": 5,
+                "textract_tps_min": 0.5,
+                "textract_tps_max": 25,
+                "textract_tps_increase": 0.5,
+                "textract_throttle_retries": 10,
+                "textract_error_retries": 3,
+                "textract_pool_connections": 0,
+                "textract_tcp_keepalive": True,
+                "textract_connect_timeout": 10,
+                "textract_read_timeout": 60,
+                "textract_retry_mode": "standard",
+                "textract_max_attempts": 1,
+                "preprocess_images": True,
+                "preprocess_max_edge": 2000,
+                "preprocess_jpeg_quality": 80,
+                "ocr_backend": "textract",
+                "pdf_text_layer": True,
+                "pdf_text_layer_min_chars": 20,
+                "tesseract_cmd": "tesseract",
+                "tesseract_lang": "eng",
+                "tesseract_batch_size": 16,
+                "tesseract_batch_wait_ms": 50,
+                "tesseract_workers": 2,
+                "analyzer": "fused",
+                "method2": "heuristic",
+                "name_scorer_model": "name_scorer_model.json",
+                "customer_index": True,
+                "customer_index_file": "customer_index.json",
+                "customer_index_max_distance": 2,
+                "extraction_memo": True,
+                "extraction_memo_file": ".extraction_memo.jsonl",
+                "scan_recursive": False,
+                "scan_sniff_magic": True,
+                "rename_journal": True,
+                "rename_journal_file": ".rename_journal.jsonl",
+                "checkpoint": True,
+                "checkpoint_file": ".receipt_checkpoint.jsonl",
+                "debug_mode": False,
+                "trace_dir": ".receipt_traces"
             }
         }
         
@@ -683,22 +3649,22 @@ if __name__ == "__main__":
         input("\nPress Enter to exit...")
         exit(1)
     
-    # Check if there are any receipt files
-    supported_formats = ['.jpg', '.jpeg', '.png', '.pdf', '.JPG', '.JPEG', '.PNG', '.PDF']
-
-    # Deduplicate files (Windows is case-insensitive)
-    files = []
-    seen_files = set()
-
-    for ext in supported_formats:
-        for file_path in Path(FOLDER_PATH).glob(f'*{ext}'):
-            file_key = file_path.name.lower()
-            
-            if file_key not in seen_files:
-                files.append(file_path)
-                seen_files.add(file_key)
+    # Count receipt files in one streaming pass, keeping only a short preview
+    with open('bank_config.json', 'r', encoding='utf-8') as f:
+        scan_settings = json.load(f).get('settings', {})
+    
+    file_count = 0
+    preview = []
+    for file_path in scan_receipt_files(
+        FOLDER_PATH,
+        recursive=scan_settings.get('scan_recursive', False),
+        sniff=scan_settings.get('scan_sniff_magic', True)
+    ):
+        file_count += 1
+        if len(preview) < 10:
+            preview.append(os.path.relpath(file_path, FOLDER_PATH))
 
-    if not files:
+    if not file_count:
         print(f"\n⚠️  No receipt files found in '{FOLDER_PATH}'")
         print("\nSupported formats: .jpg, .jpeg, .png, .pdf")
         print(f"\nFiles in folder:")
@@ -710,16 +3676,16 @@ if __name__ == "__main__":
         input("\nPress Enter to exit...")
         exit(1)
 
-    print(f"\n✓ Found {len(files)} receipt file(s)")
+    print(f"\n✓ Found {file_count} receipt file(s)")
 
     # Optionally show file list
-    if len(files) <= 10:  # Only show if 10 or fewer files
-        for i, f in enumerate(files, 1):
-            print(f"  {i}. {f.name}")
+    if file_count <= 10:  # Only show if 10 or fewer files
+        for i, name in enumerate(preview, 1):
+            print(f"  {i}. {name}")
     
     # Cost calculation
     cost_per_page = 0.0015  # detect_document_text API
-    estimated_cost = len(files) * cost_per_page
+    estimated_cost = file_count * cost_per_page
     
     # Confirm before processing
     print("\nReady to process receipts. This will:")
@@ -727,7 +3693,7 @@ if __name__ == "__main__":
     print("  2. Identify customer names")
     print("  3. Rename files with customer names")
     print(f"\n💰 Estimated cost: ${estimated_cost:.4f} USD")
-    print(f"   (${cost_per_page} per page × {len(files)} files)")
+    print(f"   (${cost_per_page} per page × {file_count} files)")
     print(f"   API: detect_document_text (text extraction only)")
     
     response = input("\nContinue? (yes/no): ").strip().lower()
@@ -741,17 +3707,20 @@ if __name__ == "__main__":
     try:
         if INTERACTIVE_MODE:
             processor = InteractiveMalaysianReceiptProcessor()
-            processor.process_folder_interactive(FOLDER_PATH)
+            processor.process_folder_interactive(FOLDER_PATH, resume=args.resume)
+        elif ASYNC_MODE:
+            processor = MalaysianBankReceiptProcessor()
+            asyncio.run(processor.aprocess_folder(FOLDER_PATH, resume=args.resume))
         else:
             processor = MalaysianBankReceiptProcessor()
-            processor.process_folder(FOLDER_PATH, max_workers=MAX_WORKERS)
+            processor.process_folder(FOLDER_PATH, max_workers=MAX_WORKERS, resume=args.resume)
         
         print("\n" + "="*60)
         print("✓ PROCESSING COMPLETE!")
         print("="*60)
         
         # Show summary of renamed files
-        success_count = sum(1 for r in processor.results if r['status'] == 'success')
+        success_count = processor.renamed_count
         if success_count > 0:
             print(f"\n✓ Successfully renamed {success_count} file(s)")
         
@@ -759,6 +3728,7 @@ if __name__ == "__main__":
         
     except KeyboardInterrupt:
         print("\n\n⚠️  Processing interrupted by user")
+        print("   Run again with --resume to skip the files already finished")
         input("\nPress Enter to exit...")
     except Exception as e:
         print(f"\n❌ Error: {e}")
@@ -2,9 +2,12 @@ import fitz  # PyMuPDF
 import os
 import re
 import csv
+import json
 from pathlib import Path
 import sys
 
+from extraction_rules import compile_rules, first_match
+
 def get_executable_dir():
     """Get the directory where the executable is located"""
     if getattr(sys, 'frozen', False):
@@ -30,63 +33,77 @@ def extract_text_from_pdf(pdf_path):
         print(f"Error processing {pdf_path}: {e}")
         return ""
 
-def extract_recipient_name(text):
+# Recipient name on DuitNow / IBG transfer receipts, e.g. "NG ENG HAN" or "MUMMY DESIGN (M) SDN. BHD."
+RECIPIENT_NAME = r"[A-Z][A-Z\s\.&,\-()]+(?:SDN\.?\s*BHD\.?)?"
+
+# Default recipient rules (extraction_rules.py syntax), tried in order.
+# Override them with "recipient_rules" in bank_config.json next to the executable.
+DEFAULT_RECIPIENT_RULES = [
+    {
+        # "To Account No. / DuitNow ID : 123/ NAME", or the name on the next line
+        "name": "duitnow_id_line",
+        "match_case": True,
+        "anchor": "To Account No. / DuitNow ID",
+        "values": [
+            {"offset": 0, "pattern": r"To Account No\. / DuitNow ID\s*:\s*[\d/]+\s*/\s*(" + RECIPIENT_NAME + ")", "min_length": 4},
+            {"offset": 1, "pattern": "^(" + RECIPIENT_NAME + ")$"}
+        ]
+    },
+    {
+        # Account line within the "Beneficiary Information" section
+        "name": "beneficiary_section",
+        "match_case": True,
+        "anchor": "Beneficiary Information",
+        "window": 9,
+        "target": ["To Account No.", "DuitNow ID"],
+        "pattern": r"[\d/]+\s*/\s*(" + RECIPIENT_NAME + ")",
+        "min_length": 4
+    },
+    {
+        "name": "to_account_line",
+        "match_case": True,
+        "anchor": "To Account No.",
+        "exclude": ["Source Account"],
+        "offset": 0,
+        "pattern": r"To Account No\.\s*/\s*DuitNow ID\s*:\s*[\d/]+\s*/\s*(" + RECIPIENT_NAME + ")",
+        "min_length": 4
+    },
+    {
+        # Fallback - any account number followed by a name at the end of a line
+        "name": "account_then_name",
+        "match_case": True,
+        "exclude": ["Source"],
+        "offset": 0,
+        "pattern": r"\d+\s*/\s*(" + RECIPIENT_NAME + r")\s*$",
+        "reject": ["MYR"],
+        "min_length": 4
+    },
+]
+
+
+def load_recipient_rules(config_path):
+    """Compile recipient rules from bank_config.json, falling back to the defaults"""
+    specs = DEFAULT_RECIPIENT_RULES
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            specs = json.load(f).get('recipient_rules') or DEFAULT_RECIPIENT_RULES
+    except (OSError, ValueError):
+        pass
+    return compile_rules(specs)
+
+
+RECIPIENT_RULES = load_recipient_rules(get_executable_dir() / "bank_config.json")
+
+
+def extract_recipient_name(text, rules=None):
     """
     Extract recipient name from bank transfer receipt.
     Looks for patterns like:
     - "To Account No. / DuitNow ID: ... / NAME"
     - "Transfer To\nNAME"
     """
-    lines = text.split('\n')
-    
-    # Pattern 1: Look specifically for "To Account No. / DuitNow ID" line
-    for i, line in enumerate(lines):
-        if 'To Account No. / DuitNow ID' in line:
-            # Extract name from the same line after the last slash
-            match = re.search(r'To Account No\. / DuitNow ID\s*:\s*[\d/]+\s*/\s*([A-Z][A-Z\s\.&,\-()]+(?:SDN\.?\s*BHD\.?)?)', line)
-            if match:
-                name = match.group(1).strip()
-                if len(name) > 3:
-                    return name
-            
-            # If not found in same line, check next line
-            if i + 1 < len(lines):
-                next_line = lines[i + 1].strip()
-                if next_line and re.match(r'^[A-Z][A-Z\s\.&,\-()]+(?:SDN\.?\s*BHD\.?)?$', next_line):
-                    return next_line
-    
-    # Pattern 2: Look for beneficiary information more specifically
-    for i, line in enumerate(lines):
-        if 'Beneficiary Information' in line:
-            # Look in subsequent lines for recipient info
-            for j in range(i + 1, min(i + 10, len(lines))):
-                if 'To Account No.' in lines[j] or 'DuitNow ID' in lines[j]:
-                    match = re.search(r'[\d/]+\s*/\s*([A-Z][A-Z\s\.&,\-()]+(?:SDN\.?\s*BHD\.?)?)', lines[j])
-                    if match:
-                        name = match.group(1).strip()
-                        if len(name) > 3:
-                            return name
-    
-    # Pattern 3: More specific pattern for recipient account
-    for line in lines:
-        if 'To Account No.' in line and not 'Source Account' in line:
-            match = re.search(r'To Account No\.\s*/\s*DuitNow ID\s*:\s*[\d/]+\s*/\s*([A-Z][A-Z\s\.&,\-()]+(?:SDN\.?\s*BHD\.?)?)', line)
-            if match:
-                name = match.group(1).strip()
-                if len(name) > 3:
-                    return name
-    
-    # Pattern 4: Fallback - look for any account number followed by company name
-    for line in lines:
-        # Look for pattern: digits/ COMPANY NAME
-        match = re.search(r'\d+\s*/\s*([A-Z][A-Z\s\.&,\-()]+(?:SDN\.?\s*BHD\.?)?)\s*$', line)
-        if match:
-            name = match.group(1).strip()
-            # Additional check to avoid source account
-            if len(name) > 3 and 'MYR' not in name and 'Source' not in line:
-                return name
-    
-    return None
+    match = first_match(rules or RECIPIENT_RULES, text.split('\n'))
+    return match.value if match else None
 
 def extract_amount(text):
     """Extract payment amount from receipt text"""
@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+# Feature columns, in model weight order
+FEATURES = [
+    'bias',
+    'length',             # characters / 40, capped at 1
+    'words',              # word count / 5, capped at 1
+    'alpha_frac',         # letters / characters
+    'upper_frac',         # uppercase / letters
+    'digit_frac',         # digits / characters
+    'other_frac',         # punctuation and non-ASCII / characters
+    'letters_only',       # 1 if only letters, spaces and dots
+    'word_count_ok',      # 1 if 2 <= words <= 5
+    'position',           # line index / (lines - 1), 0 = top of receipt
+    'has_excluded',       # contains an excluded word
+    'has_name_keyword',   # contains a name keyword itself (a label)
+    'after_name_keyword', # previous line contains a name keyword
+    'confidence',         # OCR confidence / 100
+]
+
+# Hand-tuned weights mirroring the Method 2 heuristic, used until a model
+# has been trained from past reports
+DEFAULT_MODEL = {
+    'features': FEATURES,
+    'weights': [-5.0, 0.5, 0.5, 2.0, 1.0, -4.0, -2.0, 2.5, 2.0, -2.0, -6.0, -3.0, 2.0, 0.5],
+    'threshold': 0.0,
+}
+
+# Byte -> character class: 0 other, 1 upper, 2 lower, 3 digit, 4 space, 5 dot
+_CHAR_CLASS = np.zeros(256, dtype=np.int8)
+_CHAR_CLASS[ord('A'):ord('Z') + 1] = 1
+_CHAR_CLASS[ord('a'):ord('z') + 1] = 2
+_CHAR_CLASS[ord('0'):ord('9') + 1] = 3
+_CHAR_CLASS[[ord(' '), ord('\t')]] = 4
+_CHAR_CLASS[ord('.')] = 5
+
+
+def _counts_per_line(mask, starts, ends):
+    """Count True entries of a byte mask within each [start, end) line span"""
+    cumulative = np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+    return cumulative[ends] - cumulative[starts]
+
+
+def featurize(lines, doc_sizes, has_excluded, has_keyword, confidences):
+    """
+    Build the feature matrix for every candidate line of a batch of receipts
+
+    All lines are joined into one byte buffer and classified with a lookup
+    table, so character and shape features for the whole batch come from a
+    handful of NumPy operations instead of per-line Python checks.
+
+    Args:
+        lines: Flat list of line texts for all receipts
+        doc_sizes: Number of lines of each receipt, in order
+        has_excluded: Per line, whether it contains an excluded word
+        has_keyword: Per line, whether it contains a name keyword
+        confidences: Per line OCR confidence (0-100)
+
+    Returns:
+        Array of shape (len(lines), len(FEATURES))
+    """
+    n = len(lines)
+    if n == 0:
+        return np.zeros((0, len(FEATURES)))
+
+    buffer = np.frombuffer('\x00'.join(lines).encode('utf-8', 'replace'), dtype=np.uint8)
+    separators = np.flatnonzero(buffer == 0)
+    starts = np.concatenate(([0], separators + 1))
+    ends = np.concatenate((separators, [len(buffer)]))
+    lengths = (ends - starts).astype(float)
+    safe_lengths = np.maximum(lengths, 1)
+
+    classes = _CHAR_CLASS[buffer]
+    is_char = buffer != 0
+    upper = _counts_per_line(classes == 1, starts, ends)
+    lower = _counts_per_line(classes == 2, starts, ends)
+    digits = _counts_per_line(classes == 3, starts, ends)
+    spaces = _counts_per_line(classes == 4, starts, ends)
+    dots = _counts_per_line(classes == 5, starts, ends)
+    letters = upper + lower
+    other = lengths - letters - digits - spaces - dots
+
+    # A word starts at a non-space character preceded by a space or line start
+    non_space = is_char & (classes != 4)
+    word_start = non_space & ~np.concatenate(([False], non_space[:-1]))
+    words = _counts_per_line(word_start, starts, ends)
+
+    doc_sizes = np.asarray(doc_sizes, dtype=np.int64)
+    doc_starts = np.concatenate(([0], np.cumsum(doc_sizes)[:-1]))
+    local_index = np.arange(n) - np.repeat(doc_starts, doc_sizes)
+    position = local_index / np.maximum(np.repeat(doc_sizes, doc_sizes) - 1, 1)
+
+    has_keyword = np.asarray(has_keyword, dtype=bool)
+    after_keyword = np.concatenate(([False], has_keyword[:-1]))
+    after_keyword[doc_starts[doc_sizes > 0]] = False
+
+    X = np.empty((n, len(FEATURES)))
+    X[:, 0] = 1.0
+    X[:, 1] = np.minimum(lengths / 40, 1.0)
+    X[:, 2] = np.minimum(words / 5, 1.0)
+    X[:, 3] = letters / safe_lengths
+    X[:, 4] = upper / np.maximum(letters, 1)
+    X[:, 5] = digits / safe_lengths
+    X[:, 6] = other / safe_lengths
+    X[:, 7] = (letters > 0) & (other == 0) & (digits == 0)
+    X[:, 8] = (words >= 2) & (words <= 5)
+    X[:, 9] = position
+    X[:, 10] = np.asarray(has_excluded, dtype=bool)
+    X[:, 11] = has_keyword
+    X[:, 12] = after_keyword
+    X[:, 13] = np.asarray(confidences, dtype=float) / 100
+    return X
+
+
+class NameScorer:
+    """Linear model scoring candidate name lines, a vectorized alternative to Method 2"""
+
+    def __init__(self, weights, threshold=0.0):
+        self.weights = np.asarray(weights, dtype=float)
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, model_path=None):
+        """Load a trained model, falling back to the built-in weights"""
+        model = DEFAULT_MODEL
+        if model_path and os.path.exists(model_path):
+            with open(model_path, 'r', encoding='utf-8') as f:
+                model = json.load(f)
+            if model.get('features') != FEATURES:
+                print(f"⚠️  {model_path} was trained on different features. Using defaults.")
+                model = DEFAULT_MODEL
+        return cls(model['weights'], model.get('threshold', 0.0))
+
+    def rank_lines(self, batch, top_k=None):
+        """
+        Score every line of many receipts in one call
+
+        Args:
+            batch: List of per-receipt inputs (lines, has_excluded, has_keyword, confidences)
+            top_k: Number of best lines to return per receipt (default: all)
+
+        Returns:
+            Per receipt, the (up to top_k) line indices scoring above the threshold, best first
+        """
+        doc_sizes = [len(item[0]) for item in batch]
+        X = featurize(
+            [line for item in batch for line in item[0]],
+            doc_sizes,
+            [flag for item in batch for flag in item[1]],
+            [flag for item in batch for flag in item[2]],
+            [conf for item in batch for conf in item[3]]
+        )
+        scores = X @ self.weights
+
+        # Sort by receipt, then by descending score
+        doc_ids = np.repeat(np.arange(len(batch)), doc_sizes)
+        order = np.lexsort((-scores, doc_ids))
+
+        ranked = []
+        offset = 0
+        for size in doc_sizes:
+            best = order[offset:offset + size][:top_k]
+            ranked.append([int(i) - offset for i in best if scores[i] > self.threshold])
+            offset += size
+        return ranked
+
+
+def train(X, y, epochs=2000, learning_rate=0.5, l2=1e-3):
+    """Fit logistic regression weights with batch gradient descent"""
+    weights = np.zeros(X.shape[1])
+    for _ in range(epochs):
+        predictions = 1 / (1 + np.exp(-(X @ weights)))
+        gradient = X.T @ (predictions - y) / len(y) + l2 * weights
+        weights -= learning_rate * gradient
+    return weights
+
+
+def collect_training_data(processor, report_paths):
+    """
+    Build (X, y) from past processing reports
+
+    Each successfully named receipt is looked up by its new filename and its
+    text is taken from the OCR cache or PDF text layer (no OCR calls); the
+    line matching the recorded customer name is the positive example.
+    """
+    from main import OCRDocument
+
+    def normalize(text):
+        return re.sub(r'[^a-z]', '', text.lower())
+
+    batch, labels = [], []
+    for report_path in report_paths:
+        folder = os.path.dirname(os.path.abspath(report_path))
+        try:
+            with open(report_path, 'r', encoding='utf-8') as f:
+                results = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Skipping {report_path}: {e}")
+            continue
+
+        for r in results:
+            if r.get('status') not in ('success', 'success_manual') or not r.get('new_filename'):
+                continue
+            file_path = os.path.join(folder, r['new_filename'])
+            if not os.path.exists(file_path):
+                continue
+
+            _, _, blocks, _ = processor._read_and_lookup(file_path)
+            if not blocks:
+                continue
+
+            document = OCRDocument.from_blocks(blocks)
+            target = normalize(r['customer_name'])
+            batch.append(processor.scorer_inputs(document))
+            labels.extend(float(normalize(line) == target) for line in document.lines)
+
+    if not batch:
+        return np.zeros((0, len(FEATURES))), np.zeros(0)
+
+    X = featurize(
+        [line for item in batch for line in item[0]],
+        [len(item[0]) for item in batch],
+        [flag for item in batch for flag in item[1]],
+        [flag for item in batch for flag in item[2]],
+        [conf for item in batch for conf in item[3]]
+    )
+    return X, np.asarray(labels)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the Method 2 name scorer from past reports")
+    parser.add_argument('reports', nargs='+', help="receipt_processing_report_*.json files")
+    parser.add_argument('-o', '--output', default='name_scorer_model.json', help="Model file to write")
+    parser.add_argument('-c', '--config', default='bank_config.json', help="Processor configuration")
+    args = parser.parse_args()
+
+    from main import MalaysianBankReceiptProcessor
+
+    processor = MalaysianBankReceiptProcessor(config_file=args.config)
+    X, y = collect_training_data(processor, args.reports)
+
+    if not len(y) or not y.any():
+        print("❌ No labelled receipts found (reports must point at renamed files with cached OCR text)")
+        raise SystemExit(1)
+
+    weights = train(X, y)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'features': FEATURES, 'weights': weights.round(4).tolist(), 'threshold': 0.0}, f, indent=2)
+
+    print(f"✓ Trained on {int(y.sum())} receipts ({len(y)} lines)")
+    print(f"📊 Model saved to: {args.output}")
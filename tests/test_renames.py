@@ -0,0 +1,204 @@
+"""Tests for RenamePlanner and RenameJournal (run: python -m unittest discover tests)"""
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+from main import RenameJournal, RenamePlanner
+
+
+def touch(path, data='receipt'):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+class RenamePlannerTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.folder = self._tmp.name
+        self.planner = RenamePlanner()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_free_name_is_used_as_is(self):
+        self.assertEqual(self.planner.reserve(self.folder, 'Tan_Ah_Kow_receipt', '.jpg'), 'Tan_Ah_Kow_receipt.jpg')
+
+    def test_suffix_continues_after_highest_existing(self):
+        touch(os.path.join(self.folder, 'Tan_Ah_Kow_receipt.jpg'))
+        touch(os.path.join(self.folder, 'Tan_Ah_Kow_receipt_3.jpg'))
+        self.assertEqual(self.planner.reserve(self.folder, 'Tan_Ah_Kow_receipt', '.jpg'), 'Tan_Ah_Kow_receipt_4.jpg')
+        self.assertEqual(self.planner.reserve(self.folder, 'Tan_Ah_Kow_receipt', '.jpg'), 'Tan_Ah_Kow_receipt_5.jpg')
+
+    def test_names_collide_case_insensitively(self):
+        touch(os.path.join(self.folder, 'TAN_AH_KOW_RECEIPT.JPG'))
+        self.assertEqual(self.planner.reserve(self.folder, 'Tan_Ah_Kow_receipt', '.jpg'), 'Tan_Ah_Kow_receipt_1.jpg')
+
+    def test_concurrent_reservations_never_collide(self):
+        names = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(50):
+                name = self.planner.reserve(self.folder, 'Lee_Mei_Ling_receipt', '.png')
+                with lock:
+                    names.append(name)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(names), 400)
+        self.assertEqual(len(set(names)), 400)
+
+    def test_concurrent_renames_keep_every_file(self):
+        sources = []
+        for i in range(40):
+            path = os.path.join(self.folder, f'scan_{i}.jpg')
+            touch(path, str(i))
+            sources.append(path)
+
+        threads = [threading.Thread(target=self.planner.rename, args=(path, 'Wong_Chun_Tim_receipt', '.jpg'))
+                   for path in sources]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        files = os.listdir(self.folder)
+        self.assertEqual(len(files), 40)
+        self.assertTrue(all(name.startswith('Wong_Chun_Tim_receipt') for name in files))
+        self.assertEqual(sorted(read(os.path.join(self.folder, name)) for name in files),
+                         sorted(str(i) for i in range(40)))
+
+    def test_file_created_after_listing_is_not_overwritten(self):
+        src = os.path.join(self.folder, 'scan.jpg')
+        touch(src, 'new')
+        self.planner.reserve(self.folder, 'other', '.jpg')  # lists the folder
+        touch(os.path.join(self.folder, 'Tan_Ah_Kow_receipt.jpg'), 'old')
+
+        name = self.planner.rename(src, 'Tan_Ah_Kow_receipt', '.jpg')
+
+        self.assertEqual(name, 'Tan_Ah_Kow_receipt_1.jpg')
+        self.assertEqual(read(os.path.join(self.folder, 'Tan_Ah_Kow_receipt.jpg')), 'old')
+        self.assertEqual(read(os.path.join(self.folder, name)), 'new')
+
+
+class RenameJournalTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.folder = self._tmp.name
+        self.journal_file = os.path.join(self.folder, '.rename_journal.jsonl')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def crashed_run(self, src, dst, renamed):
+        """A run that planned src -> dst and stopped before logging 'done'"""
+        journal = RenameJournal(self.journal_file)
+        journal.plan(self.path(src), self.path(dst))
+        if renamed:
+            os.rename(self.path(src), self.path(dst))
+        journal.close()
+
+    def states(self):
+        journal = RenameJournal(self.journal_file)
+        try:
+            return [e['state'] for e in journal.replay()]
+        finally:
+            journal.close()
+
+    def test_recover_completes_plan_whose_rename_happened(self):
+        touch(self.path('scan.jpg'))
+        self.crashed_run('scan.jpg', 'Tan_Ah_Kow_receipt.jpg', renamed=True)
+
+        journal = RenameJournal(self.journal_file)
+        self.assertEqual(journal.recover(), [('scan.jpg', 'Tan_Ah_Kow_receipt.jpg')])
+        journal.close()
+        self.assertEqual(self.states(), ['done'])
+
+    def test_recover_aborts_plan_whose_rename_did_not_happen(self):
+        touch(self.path('scan.jpg'))
+        self.crashed_run('scan.jpg', 'Tan_Ah_Kow_receipt.jpg', renamed=False)
+
+        journal = RenameJournal(self.journal_file)
+        self.assertEqual(journal.recover(), [])
+        journal.close()
+        self.assertEqual(self.states(), ['abort'])
+        self.assertTrue(os.path.exists(self.path('scan.jpg')))
+
+    def test_recover_finishes_link_unlink_window(self):
+        touch(self.path('scan.jpg'), 'data')
+        self.crashed_run('scan.jpg', 'Tan_Ah_Kow_receipt.jpg', renamed=False)
+        os.link(self.path('scan.jpg'), self.path('Tan_Ah_Kow_receipt.jpg'))
+
+        journal = RenameJournal(self.journal_file)
+        self.assertEqual(journal.recover(), [('scan.jpg', 'Tan_Ah_Kow_receipt.jpg')])
+        journal.close()
+        self.assertFalse(os.path.exists(self.path('scan.jpg')))
+        self.assertEqual(read(self.path('Tan_Ah_Kow_receipt.jpg')), 'data')
+
+    def test_recover_ignores_torn_last_line(self):
+        touch(self.path('scan.jpg'))
+        self.crashed_run('scan.jpg', 'Tan_Ah_Kow_receipt.jpg', renamed=True)
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write('{"run": "x", "id": 1, "op": "pl')
+
+        journal = RenameJournal(self.journal_file)
+        self.assertEqual(journal.recover(), [('scan.jpg', 'Tan_Ah_Kow_receipt.jpg')])
+        journal.close()
+
+    def run_renames(self, renames):
+        """One complete run renaming each (src, stem) pair"""
+        planner = RenamePlanner()
+        journal = RenameJournal(self.journal_file)
+        for src, stem in renames:
+            planner.rename(self.path(src), stem, '.jpg', journal)
+        journal.close()
+
+    def undo(self, all_runs):
+        journal = RenameJournal(self.journal_file)
+        with contextlib.redirect_stdout(io.StringIO()):
+            restored = journal.undo(all_runs=all_runs)
+        journal.close()
+        return restored
+
+    def test_undo_reverts_latest_run_only(self):
+        touch(self.path('a.jpg'))
+        touch(self.path('b.jpg'))
+        self.run_renames([('a.jpg', 'Tan_Ah_Kow_receipt')])
+        self.run_renames([('b.jpg', 'Tan_Ah_Kow_receipt')])
+
+        self.assertEqual(self.undo(all_runs=False), 1)
+        self.assertEqual(sorted(n for n in os.listdir(self.folder) if not n.startswith('.')),
+                         ['Tan_Ah_Kow_receipt.jpg', 'b.jpg'])
+
+        # The undone run is not undone twice; the next undo reaches the earlier run
+        self.assertEqual(self.undo(all_runs=False), 1)
+        self.assertEqual(sorted(n for n in os.listdir(self.folder) if not n.startswith('.')),
+                         ['a.jpg', 'b.jpg'])
+
+    def test_undo_all_runs(self):
+        touch(self.path('a.jpg'))
+        touch(self.path('b.jpg'))
+        self.run_renames([('a.jpg', 'Tan_Ah_Kow_receipt')])
+        self.run_renames([('b.jpg', 'Tan_Ah_Kow_receipt')])
+
+        self.assertEqual(self.undo(all_runs=True), 2)
+        self.assertEqual(sorted(n for n in os.listdir(self.folder) if not n.startswith('.')),
+                         ['a.jpg', 'b.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()